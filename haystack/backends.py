@@ -0,0 +1,226 @@
+import logging
+import os
+import threading
+import time
+import httpx
+from gradio_client import Client
+
+
+# Endpoint list from FLORENCE_ENDPOINTS (comma separated), or the default
+def endpoints_from_env(default):
+    value = os.environ.get("FLORENCE_ENDPOINTS", "")
+    endpoints = [url.strip() for url in value.split(",") if url.strip()]
+    return endpoints or list(default)
+
+
+# client.predict() through a job, so a request that hangs is cancelled and
+# raises TimeoutError after timeout seconds (None waits forever)
+def predict_with_timeout(client, timeout=None, **kwargs):
+    job = client.submit(**kwargs)
+    try:
+        return job.result(timeout=timeout)
+    except TimeoutError:
+        job.cancel()
+        raise TimeoutError(f"Florence request timed out after {timeout}s") from None
+
+
+class Backend:
+    # One Florence endpoint plus its load and health bookkeeping
+    def __init__(self, url):
+        self.url = url if url.endswith("/") else url + "/"
+        self.client = None
+        self.healthy = True
+        self.outstanding = 0
+        self.completed = 0
+        self.failed = 0
+        self.consecutive_failures = 0
+        self.busy_seconds = 0.0
+        self.last_error = None
+        self._client_lock = threading.Lock()
+
+    # Created on first use; the lock keeps concurrent first requests from
+    # each building their own client
+    def get_client(self):
+        with self._client_lock:
+            if self.client is None:
+                self.client = Client(self.url)
+            return self.client
+
+
+class BackendPool:
+    # Spreads Florence requests over several endpoints. Each request goes to
+    # the healthy endpoint with the fewest outstanding requests; requests that
+    # share an affinity key (e.g. the tasks of one image, whose upload lives
+    # on one server) stick to the same endpoint while it stays healthy.
+    # Endpoints are ejected after max_failures consecutive errors or a failed
+    # health check, and come back once a health check succeeds again. A
+    # request that failed on every endpoint is retried up to `retries` more
+    # times, waiting retry_backoff seconds, doubled after each round.
+    # predict() gives up on a request after request_timeout seconds, which
+    # counts as a failure like any other error.
+    def __init__(
+        self,
+        urls,
+        health_interval=10.0,
+        max_failures=3,
+        wait_timeout=60.0,
+        retries=0,
+        retry_backoff=1.0,
+        request_timeout=None,
+    ):
+        if not urls:
+            raise ValueError("At least one Florence endpoint is required.")
+        self.backends = [Backend(url) for url in urls]
+        self.health_interval = health_interval
+        self.max_failures = max_failures
+        self.wait_timeout = wait_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.request_timeout = request_timeout
+        self._affinity = {}
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._health_thread = None
+        self._started = time.perf_counter()
+
+    def _choose(self, key, exclude):
+        healthy = [b for b in self.backends if b.healthy and b not in exclude]
+        if not healthy:
+            return None
+        backend = self._affinity.get(key) if key is not None else None
+        if backend not in healthy:
+            backend = min(healthy, key=lambda b: b.outstanding)
+            if key is not None:
+                self._affinity[key] = backend
+        return backend
+
+    def _acquire(self, key, exclude):
+        deadline = time.monotonic() + self.wait_timeout
+        with self._condition:
+            while True:
+                backend = self._choose(key, exclude)
+                if backend is not None:
+                    backend.outstanding += 1
+                    return backend
+                if any(b.healthy for b in self.backends):
+                    return None  # Every healthy endpoint already failed this request
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RuntimeError("No healthy Florence endpoints available.")
+                self._condition.wait(remaining)
+
+    def _release(self, backend, elapsed, error=None):
+        with self._condition:
+            backend.outstanding -= 1
+            backend.busy_seconds += elapsed
+            if error is None:
+                backend.completed += 1
+                backend.consecutive_failures = 0
+            else:
+                backend.failed += 1
+                backend.consecutive_failures += 1
+                backend.last_error = repr(error)
+                if backend.healthy and backend.consecutive_failures >= self.max_failures:
+                    self._eject(backend)
+            self._condition.notify_all()
+
+    def _eject(self, backend):
+        backend.healthy = False
+        backend.client = None
+        logging.warning(f"Ejecting Florence endpoint {backend.url}: {backend.last_error}")
+
+    # Run fn(client) on a backend, failing over to the other endpoints if it
+    # raises and retrying with backoff once all of them failed. Related
+    # requests should pass the same affinity key.
+    def run(self, fn, key=None):
+        tried = []
+        last_error = None
+        attempt = 0
+        while True:
+            backend = self._acquire(key, tried)
+            if backend is None:
+                if attempt >= self.retries:
+                    raise last_error
+                time.sleep(self.retry_backoff * 2 ** attempt)
+                attempt += 1
+                tried = []
+                continue
+            start_time = time.perf_counter()
+            try:
+                result = fn(backend.get_client())
+            except Exception as e:
+                self._release(backend, time.perf_counter() - start_time, e)
+                tried.append(backend)
+                last_error = e
+                continue
+            self._release(backend, time.perf_counter() - start_time)
+            return result
+
+    def predict(self, key=None, **kwargs):
+        return self.run(lambda client: predict_with_timeout(client, self.request_timeout, **kwargs), key)
+
+    # Drop the affinity entry once the related requests are done
+    def forget(self, key):
+        with self._condition:
+            self._affinity.pop(key, None)
+
+    def check_health(self):
+        for backend in self.backends:
+            try:
+                response = httpx.get(f"{backend.url}config", timeout=5.0)
+                ok = response.status_code == 200
+                error = None if ok else f"HTTP {response.status_code}"
+            except httpx.HTTPError as e:
+                ok = False
+                error = repr(e)
+            with self._condition:
+                if ok and not backend.healthy:
+                    backend.healthy = True
+                    backend.consecutive_failures = 0
+                    logging.warning(f"Florence endpoint {backend.url} is back")
+                elif not ok and backend.healthy:
+                    backend.last_error = error
+                    self._eject(backend)
+                self._condition.notify_all()
+
+    def start_health_checks(self):
+        def loop():
+            while not self._stop.wait(self.health_interval):
+                self.check_health()
+
+        self._health_thread = threading.Thread(target=loop, daemon=True)
+        self._health_thread.start()
+
+    def stats(self):
+        elapsed = time.perf_counter() - self._started
+        with self._condition:
+            return [
+                {
+                    "url": b.url,
+                    "healthy": b.healthy,
+                    "outstanding": b.outstanding,
+                    "completed": b.completed,
+                    "failed": b.failed,
+                    "requests_per_second": b.completed / elapsed if elapsed else 0.0,
+                    "mean_latency": b.busy_seconds / (b.completed + b.failed)
+                    if b.completed + b.failed
+                    else 0.0,
+                    "last_error": b.last_error,
+                }
+                for b in self.backends
+            ]
+
+    def report(self):
+        lines = ["Florence endpoints:"]
+        for s in self.stats():
+            status = "healthy" if s["healthy"] else "ejected"
+            lines.append(
+                f"  {s['url']} ({status}): {s['completed']} ok, {s['failed']} failed, "
+                f"{s['requests_per_second']:.2f} req/s, {s['mean_latency']:.2f}s mean latency"
+            )
+        return "\n".join(lines)
+
+    def close(self):
+        self._stop.set()
+        if self._health_thread is not None:
+            self._health_thread.join(timeout=1.0)
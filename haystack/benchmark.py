@@ -1,29 +1,65 @@
 import os
 import time
+import argparse
 import platform
 import psutil
-from pynvml import (
-    nvmlInit,
-    nvmlDeviceGetHandleByIndex,
-    nvmlDeviceGetMemoryInfo,
-    nvmlDeviceGetUtilizationRates,
-    nvmlDeviceGetTemperature,
-    nvmlDeviceGetClockInfo,
-    nvmlDeviceGetFanSpeed,
-    nvmlDeviceGetPowerUsage,
-    nvmlShutdown,
-    NVML_TEMPERATURE_GPU,
-)
 from alive_progress import alive_bar
-from gradio_client import Client, handle_file
+import gradio_client
+from gradio_client import handle_file
+from backends import BackendPool, endpoints_from_env
+from benchmark_runs import save_run
+from dispatcher import InferenceDispatcher
+from latency import summarize
+from sampler import ResourceSampler
 import pandas as pd
 import signal
 import sys
 from prettytable import PrettyTable
 import threading
 
-# Initialize Gradio client
-client = Client("http://127.0.0.1:7860/")
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark Florence-2 models on the images in benchmark/."
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=2,
+        help="Untimed requests per model and resolution before measuring",
+    )
+    parser.add_argument(
+        "--concurrency",
+        default="1,2,4,8",
+        help="Comma-separated numbers of requests in flight to sweep",
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=16,
+        help="Timed requests per concurrency level",
+    )
+    parser.add_argument(
+        "--sample-interval",
+        type=float,
+        default=0.1,
+        help="Seconds between CPU/GPU resource samples",
+    )
+    parser.add_argument(
+        "--live-stats",
+        type=float,
+        default=5.0,
+        help="Seconds between live resource tables; 0 turns them off",
+    )
+    return parser.parse_args()
+
+
+args = parse_args()
+concurrency_levels = sorted({int(level) for level in args.concurrency.split(",") if level.strip()})
+
+# Florence servers to benchmark; override with FLORENCE_ENDPOINTS (comma separated)
+pool = BackendPool(endpoints_from_env(["http://127.0.0.1:7860/"]))
+pool.start_health_checks()
 
 # Florence models to benchmark
 models = [
@@ -55,144 +91,128 @@ if not resolution_folders:
 supported_formats = (".jpg", ".jpeg", ".png", ".webp")
 
 
+# Resource metrics are sampled in the background for the whole run; GPU
+# metrics are added when NVML finds an NVIDIA GPU
+sampler = ResourceSampler(interval=args.sample_interval).start()
+if sampler.gpu is None:
+    print(f"GPU metrics unavailable ({sampler.gpu_error}); sampling CPU only.")
+
+
 # Handle Ctrl+C to exit gracefully
 def signal_handler(sig, frame):
     print("\nBenchmark interrupted. Exiting...")
-    nvmlShutdown()  # Shut down NVML
+    sampler.close()
     sys.exit(0)
 
 
 signal.signal(signal.SIGINT, signal_handler)
 
 
+# System fingerprint saved with every run, so runs from different machines,
+# drivers or client versions aren't mistaken for regressions
+def system_fingerprint():
+    fingerprint = {
+        "OS": f"{platform.system()} {platform.release()} ({platform.version()})",
+        "Processor": platform.processor(),
+        "CPU Cores": f"{psutil.cpu_count(logical=False)} physical, {psutil.cpu_count(logical=True)} logical",
+        "Total Memory (GB)": round(psutil.virtual_memory().total / (1024 ** 3), 2),
+        "Python": platform.python_version(),
+        "gradio_client": gradio_client.__version__,
+        "Endpoints": ", ".join(backend.url for backend in pool.backends),
+    }
+    gpu = sampler.gpu_info()
+    fingerprint["GPU"] = gpu["name"] if gpu else None
+    fingerprint["GPU Driver"] = gpu["driver"] if gpu else None
+    return fingerprint
+
+
 # Display system specs
-def display_system_specs():
+def display_system_specs(fingerprint):
     print("System Specifications:")
-    print(f"  OS: {platform.system()} {platform.release()} ({platform.version()})")
-    print(f"  Processor: {platform.processor()}")
-    print(
-        f"  CPU Cores: {psutil.cpu_count(logical=False)} physical, {psutil.cpu_count(logical=True)} logical"
-    )
-    memory = psutil.virtual_memory()
-    print(f"  Total Memory: {round(memory.total / (1024 ** 3), 2)} GB")
+    print(f"  OS: {fingerprint['OS']}")
+    print(f"  Processor: {fingerprint['Processor']}")
+    print(f"  CPU Cores: {fingerprint['CPU Cores']}")
+    print(f"  Total Memory: {fingerprint['Total Memory (GB)']} GB")
+    if fingerprint["GPU"]:
+        print(f"  GPU: {fingerprint['GPU']} (driver {fingerprint['GPU Driver']})")
     print()
     print("Press Ctrl+C at any time to stop the benchmark.")
     print()
 
 
-display_system_specs()
-
-# Initialize NVML for GPU stats
-nvmlInit()
-
-
-# Function to get system stats and track max values
-def get_system_stats_tracker():
-    stats = {
-        "CPU Load": 0,
-        "GPU Load": 0,
-        "GPU Temp": 0,
-        "GPU Core Clock": 0,
-        "GPU Fan Speed": "N/A",
-        "GPU Power Usage": "N/A",
-    }
-
-    def get_stats():
-        nonlocal stats
-
-        # CPU Stats
-        cpu_load = psutil.cpu_percent(interval=None)
-        stats["CPU Load"] = f"CPU Load: {cpu_load}%"       
-
-        # GPU Stats
-        try:
-            handle = nvmlDeviceGetHandleByIndex(0)  # Use the first GPU
-
-            utilization = nvmlDeviceGetUtilizationRates(handle)
-            stats["GPU Load"] = f"{utilization.gpu}%"
-
-            gpu_temp = nvmlDeviceGetTemperature(handle, NVML_TEMPERATURE_GPU)
-            stats["GPU Temp"] = f"GPU Temperature: {gpu_temp}°C"
-
-            gpu_core_clock = nvmlDeviceGetClockInfo(handle, 0)  # Graphics clock
-            stats["GPU Core Clock"] = f"GPU Core Clock: {gpu_core_clock} MHz"
-
-            gpu_fan_speed = nvmlDeviceGetFanSpeed(handle)
-            stats["GPU Fan Speed"] = f"{gpu_fan_speed}%"
-
-            gpu_power_usage = nvmlDeviceGetPowerUsage(handle) / 1000  # Convert to watts
-            stats["GPU Power Usage"] = f"{gpu_power_usage} W"
-        except Exception:
-            pass
-
-        return stats
-
-    return get_stats
-
-
-# Initialize the stats tracker
-get_system_stats = get_system_stats_tracker()
+fingerprint = system_fingerprint()
+display_system_specs(fingerprint)
 
 
 def update_stats_realtime():
     while True:
+        time.sleep(args.live_stats)
+        latest = sampler.latest()
+        if latest is None:
+            continue
         os.system("cls" if os.name == "nt" else "clear")
-        stats = get_system_stats()
+        stats = {"CPU Load": f"{latest['cpu_percent']:.0f}%", "RSS": f"{latest['rss_mb']:.0f} MB"}
+        if sampler.gpu is not None:
+            stats.update(
+                {
+                    "GPU Load": f"{latest['gpu_percent']:.0f}%",
+                    "GPU Memory": f"{latest['gpu_memory_mb']:.0f} MB",
+                    "GPU Temp": f"{latest['gpu_temp_c']:.0f}°C",
+                    "GPU Core Clock": f"{latest['gpu_clock_mhz']:.0f} MHz",
+                    "GPU Fan Speed": f"{latest['gpu_fan_percent']:.0f}%",
+                    "GPU Power Usage": f"{latest['gpu_power_w']:.1f} W",
+                }
+            )
         table = PrettyTable()
         table.align = "r"
         table.padding_width = 2
         table.field_names = stats.keys()
         table.add_row(stats.values())
         print(table)
-        time.sleep(5)
 
 
 # Start a thread for real-time stats
-threading.Thread(target=update_stats_realtime, daemon=True).start()
-
-
-# Function to determine optimal batch size
-def get_optimal_batch_size(image_resolution, max_memory_fraction=0.8):
-    resolution_to_memory = {
-        "720p": 50 * 1024 * 1024,  # ~50 MB per image
-        "1080p": 100 * 1024 * 1024,  # ~100 MB per image
-        "1440p": 200 * 1024 * 1024,  # ~200 MB per image
-        "4k": 400 * 1024 * 1024,  # ~400 MB per image
-    }
-    memory_per_image = resolution_to_memory.get(image_resolution, 100 * 1024 * 1024)
+if args.live_stats > 0:
+    threading.Thread(target=update_stats_realtime, daemon=True).start()
 
-    # Get GPU memory
-    handle = nvmlDeviceGetHandleByIndex(0)  # First GPU
-    memory_info = nvmlDeviceGetMemoryInfo(handle)
-    free_memory = (
-        memory_info.free * max_memory_fraction
-    )  # Use a fraction of available memory
 
-    # Calculate optimal batch size
-    return max(1, int(free_memory / memory_per_image))
-
-
-# Function to process a batch of images with a model
-def process_images_with_model(image_paths, model_id):
-    start_time = time.time()
-    results = [
-        client.predict(
+# Time a single Object Detection request. Errors are recorded rather than
+# raised so one failing request doesn't end the run.
+def timed_request(image_path, model_id):
+    start_time = time.perf_counter()
+    error = None
+    try:
+        pool.predict(
             image=handle_file(image_path),
             task_prompt="Object Detection",
             text_input=None,
             model_id=model_id,
             api_name="/process_image",
         )
-        for image_path in image_paths
-    ]
-    end_time = time.time()
-    return end_time - start_time, results
-
-
-# Benchmarking
-summary = []
-total_steps = len(models) * sum(
-    len(os.listdir(folder)) for folder in resolution_folders if os.listdir(folder)
+    except Exception as e:
+        error = repr(e)
+    return start_time, time.perf_counter(), error
+
+
+# Closed-loop run: `count` requests cycling over the images with exactly
+# `level` of them in flight at a time. Returns the start and end of the level
+# and the (image, (start, end, error)) of every request.
+def run_concurrency_level(image_paths, model_id, level, count):
+    jobs = [image_paths[i % len(image_paths)] for i in range(count)]
+    start_time = time.perf_counter()
+    with InferenceDispatcher(max_workers=level, max_in_flight=level) as dispatcher:
+        futures = [(image, dispatcher.submit(timed_request, image, model_id)) for image in jobs]
+        results = [(image, future.result()) for image, future in futures]
+    return start_time, time.perf_counter(), results
+
+
+# Benchmarking: for every model and resolution, warm up (model load and
+# server caches are excluded from the timings), then sweep the in-flight
+# levels and time every request
+summary = []  # One row per timed request
+levels = []  # One row per (model, resolution, concurrency)
+total_steps = len(models) * len(resolution_folders) * (
+    args.warmup + len(concurrency_levels) * args.requests
 )
 
 try:
@@ -207,57 +227,136 @@ try:
                 ]
 
                 if not images:
+                    bar(args.warmup + len(concurrency_levels) * args.requests)
                     continue
 
-                batch_size = get_optimal_batch_size(folder_name)
-                for i in range(0, len(images), batch_size):
-                    batch = images[i : i + batch_size]
-                    bar.text(
-                        f"Processing batch ({len(batch)} images) at {folder_name} with {model}"
-                    )
+                for i in range(args.warmup):
+                    bar.text(f"Warming up {model} at {folder_name}")
+                    timed_request(images[i % len(images)], model)
+                    bar()
 
-                    processing_time, _ = process_images_with_model(batch, model)
+                for level in concurrency_levels:
+                    bar.text(f"{model} at {folder_name}: {level} in flight")
+                    level_start, level_end, results = run_concurrency_level(
+                        images, model, level, args.requests
+                    )
+                    wall_time = level_end - level_start
+                    usage = sampler.window(level_start, level_end)
+                    errors = sum(1 for _, (_, _, error) in results if error)
+                    levels.append(
+                        {
+                            "Model": model,
+                            "Resolution": folder_name,
+                            "Concurrency": level,
+                            "Requests": len(results),
+                            "Errors": errors,
+                            "Requests/s": (len(results) - errors) / wall_time if wall_time else 0.0,
+                            "CPU %": usage["cpu_percent_mean"],
+                            "GPU %": usage["gpu_percent_mean"],
+                            "GPU Power (W)": usage["gpu_power_w_mean"],
+                        }
+                    )
                     summary.extend(
                         {
                             "Model": model,
                             "Resolution": folder_name,
+                            "Concurrency": level,
                             "Image": os.path.basename(image),
-                            "Time (s)": round(processing_time / len(batch), 2),
-                            **get_system_stats(),
+                            "Time (s)": end - start,
+                            "Error": error,
+                            **sampler.window(start, end),
                         }
-                        for image in batch
+                        for image, (start, end, error) in results
                     )
-                    bar(len(batch))  # Advance the progress bar by the batch size
+                    bar(args.requests)
 except KeyboardInterrupt:
     print("\nBenchmark interrupted by user. Exiting...")
-    nvmlShutdown()
+    sampler.close()
     sys.exit(0)
 
-# Shut down NVML after the benchmark
-nvmlShutdown()
+sampler.close()
+print(pool.report())
+pool.close()
+
+# Save the run with its fingerprint for later comparison (benchmark_runs.py)
+if summary:
+    run_path = save_run(
+        fingerprint,
+        {
+            "Models": models,
+            "Resolutions": [os.path.basename(folder) for folder in resolution_folders],
+            "Concurrency": concurrency_levels,
+            "Warmup": args.warmup,
+            "Requests": args.requests,
+        },
+        summary,
+        levels,
+    )
+    print(f"Benchmark run saved as: {run_path}")
 
 # Print the summary in tabular format
 df_summary = pd.DataFrame(summary)
 print("\nBenchmark Results:")
 if not df_summary.empty:
-    grouped = df_summary.groupby(["Model", "Resolution"]).agg(
-        {"Time (s)": ["mean", "sum"]}
-    )
-    print(grouped)
-
-    # Calculate overall benchmark metrics
-    avg_times = grouped["Time (s)"]["mean"].groupby("Model").mean()
-    best_model = avg_times.idxmin()
-    best_model_time = avg_times.min()
+    ok = df_summary[df_summary["Error"].isna()]
+    latencies = {
+        key: group["Time (s)"].tolist()
+        for key, group in ok.groupby(["Model", "Resolution", "Concurrency"])
+    }
 
-    avg_resolution = grouped["Time (s)"]["mean"].groupby("Resolution").mean()
-    best_resolution = avg_resolution.idxmin()
-    best_resolution_time = avg_resolution.min()
+    table = PrettyTable()
+    table.field_names = [
+        "Model", "Resolution", "In flight", "Req/s", "Mean (s)", "p50 (s)", "p90 (s)", "p99 (s)", "Max (s)", "Errors",
+        "CPU %", "GPU %",
+    ]
+    table.align = "r"
+    table.align["Model"] = "l"
+    for row in levels:
+        stats = summarize(latencies.get((row["Model"], row["Resolution"], row["Concurrency"]), []))
+        table.add_row(
+            [
+                row["Model"],
+                row["Resolution"],
+                row["Concurrency"],
+                f"{row['Requests/s']:.2f}",
+                *(f"{stats[key]:.3f}" for key in ("mean", "p50", "p90", "p99", "max")),
+                row["Errors"],
+                f"{row['CPU %']:.0f}",
+                f"{row['GPU %']:.0f}" if row["GPU %"] == row["GPU %"] else "-",  # NaN without a GPU
+            ]
+        )
+    print(table)
+
+    # Saturation point: the lowest in-flight level that reaches 90% of the
+    # best throughput; more concurrency beyond it only adds queueing
+    print("\nSaturation Points:")
+    df_levels = pd.DataFrame(levels)
+    for (model, resolution), group in df_levels.groupby(["Model", "Resolution"], sort=False):
+        best = group["Requests/s"].max()
+        saturated = group[group["Requests/s"] >= 0.9 * best].iloc[0]
+        print(
+            f"  {model} at {resolution}: {saturated['Concurrency']} in flight "
+            f"({saturated['Requests/s']:.2f} req/s, best {best:.2f} req/s)"
+        )
 
+    # Calculate overall benchmark metrics from single-request latency
     print("\nOverall Benchmark Results:")
-    print(f"Best Model: {best_model} (Average Time: {best_model_time:.2f} seconds)")
-    print(
-        f"Best Resolution: {best_resolution} (Average Time: {best_resolution_time:.2f} seconds)"
-    )
+    single = ok[ok["Concurrency"] == concurrency_levels[0]]
+    if single.empty:
+        print(f"No successful runs at {concurrency_levels[0]} in flight; every request errored.")
+    else:
+        grouped = single.groupby(["Model", "Resolution"]).agg({"Time (s)": ["mean", "sum"]})
+        avg_times = grouped["Time (s)"]["mean"].groupby("Model").mean()
+        best_model = avg_times.idxmin()
+        best_model_time = avg_times.min()
+
+        avg_resolution = grouped["Time (s)"]["mean"].groupby("Resolution").mean()
+        best_resolution = avg_resolution.idxmin()
+        best_resolution_time = avg_resolution.min()
+
+        print(f"Best Model: {best_model} (Average Time: {best_model_time:.2f} seconds)")
+        print(
+            f"Best Resolution: {best_resolution} (Average Time: {best_resolution_time:.2f} seconds)"
+        )
 else:
     print("No results to display. Benchmark was incomplete.")
@@ -0,0 +1,199 @@
+import argparse
+import json
+import math
+import os
+import sys
+from datetime import datetime
+from prettytable import PrettyTable
+from latency import summarize
+
+# Saved benchmark runs; one JSON file per run
+runs_dir = "./benchmark_runs"
+
+
+# NaN (e.g. GPU metrics without a GPU) and infinities become null, which
+# strict JSON readers accept
+def json_safe(value):
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    return value
+
+
+# Write a finished run: fingerprint, the benchmark matrix and raw timings
+def save_run(fingerprint, matrix, requests, levels, directory=runs_dir):
+    os.makedirs(directory, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(directory, f"run-{timestamp}.json")
+    run = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "fingerprint": fingerprint,
+        "matrix": matrix,
+        "requests": requests,
+        "levels": levels,
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(json_safe(run), f, indent=2, default=str, allow_nan=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_run(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+# Two-sided Mann-Whitney U test with the normal approximation and a tie
+# correction. Returns (U of the first sample, p-value). Needs no
+# assumptions about the latency distribution, which is rarely normal.
+def mann_whitney_u(a, b):
+    n1, n2 = len(a), len(b)
+    if not n1 or not n2:
+        return 0.0, 1.0
+    values = sorted([(v, 0) for v in a] + [(v, 1) for v in b])
+    ranks = [0.0] * len(values)
+    tie_term = 0.0
+    i = 0
+    while i < len(values):
+        j = i
+        while j + 1 < len(values) and values[j + 1][0] == values[i][0]:
+            j += 1
+        rank = (i + j) / 2 + 1
+        for k in range(i, j + 1):
+            ranks[k] = rank
+        ties = j - i + 1
+        tie_term += ties ** 3 - ties
+        i = j + 1
+
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, values) if group == 0)
+    u = rank_sum - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        return u, 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / math.sqrt(variance)  # Continuity correction
+    return u, math.erfc(max(z, 0.0) / math.sqrt(2))
+
+
+def latencies_by_level(run):
+    groups = {}
+    for row in run["requests"]:
+        if row.get("Error"):
+            continue
+        key = (row["Model"], row["Resolution"], row["Concurrency"])
+        groups.setdefault(key, []).append(row["Time (s)"])
+    return groups
+
+
+# Fingerprint fields that differ between two runs
+def fingerprint_changes(base, new):
+    keys = sorted(set(base) | set(new))
+    return [(key, base.get(key), new.get(key)) for key in keys if base.get(key) != new.get(key)]
+
+
+# Compare the median latency of every (model, resolution, concurrency) cell.
+# A cell regresses when the new run is slower by more than threshold percent
+# and the difference is significant at alpha.
+def compare_runs(base, new, threshold=10.0, alpha=0.05):
+    base_groups = latencies_by_level(base)
+    new_groups = latencies_by_level(new)
+    base_levels = {(r["Model"], r["Resolution"], r["Concurrency"]): r for r in base["levels"]}
+    new_levels = {(r["Model"], r["Resolution"], r["Concurrency"]): r for r in new["levels"]}
+    rows = []
+    for key in sorted(set(base_groups) & set(new_groups), key=str):
+        before = summarize(base_groups[key])
+        after = summarize(new_groups[key])
+        change = (after["p50"] - before["p50"]) / before["p50"] * 100 if before["p50"] else 0.0
+        _, p_value = mann_whitney_u(base_groups[key], new_groups[key])
+        significant = p_value < alpha
+        rows.append(
+            {
+                "key": key,
+                "base_p50": before["p50"],
+                "new_p50": after["p50"],
+                "base_p99": before["p99"],
+                "new_p99": after["p99"],
+                "change": change,
+                "p_value": p_value,
+                "base_rps": base_levels.get(key, {}).get("Requests/s"),
+                "new_rps": new_levels.get(key, {}).get("Requests/s"),
+                "regression": significant and change > threshold,
+                "improvement": significant and change < -threshold,
+            }
+        )
+    missing = sorted(set(base_groups) ^ set(new_groups), key=str)
+    return rows, missing
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare two saved benchmark runs and fail on significant slowdowns."
+    )
+    parser.add_argument("base", help="Baseline run file (benchmark_runs/run-*.json)")
+    parser.add_argument("new", help="Run to check against the baseline")
+    parser.add_argument(
+        "--threshold", type=float, default=10.0, help="Median slowdown in percent that fails the check"
+    )
+    parser.add_argument("--alpha", type=float, default=0.05, help="Significance level")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    base = load_run(args.base)
+    new = load_run(args.new)
+
+    changes = fingerprint_changes(base["fingerprint"], new["fingerprint"])
+    if changes:
+        print("System fingerprint changed:")
+        for key, before, after in changes:
+            print(f"  {key}: {before} -> {after}")
+        print()
+
+    rows, missing = compare_runs(base, new, args.threshold, args.alpha)
+    table = PrettyTable()
+    table.field_names = [
+        "Model", "Resolution", "In flight", "p50 before (s)", "p50 after (s)", "Change",
+        "p99 before (s)", "p99 after (s)", "Req/s before", "Req/s after", "p-value", "Result",
+    ]
+    table.align = "r"
+    table.align["Model"] = "l"
+    for row in rows:
+        model, resolution, level = row["key"]
+        result = "REGRESSION" if row["regression"] else "faster" if row["improvement"] else "-"
+        table.add_row(
+            [
+                model,
+                resolution,
+                level,
+                f"{row['base_p50']:.3f}",
+                f"{row['new_p50']:.3f}",
+                f"{row['change']:+.1f}%",
+                f"{row['base_p99']:.3f}",
+                f"{row['new_p99']:.3f}",
+                f"{row['base_rps']:.2f}" if row["base_rps"] is not None else "-",
+                f"{row['new_rps']:.2f}" if row["new_rps"] is not None else "-",
+                f"{row['p_value']:.4f}",
+                result,
+            ]
+        )
+    print(table)
+    for key in missing:
+        print(f"Only in one run: {' / '.join(str(k) for k in key)}")
+
+    regressions = [row for row in rows if row["regression"]]
+    if regressions:
+        print(
+            f"\n{len(regressions)} significant slowdowns above {args.threshold:g}% "
+            f"(alpha {args.alpha:g})."
+        )
+        sys.exit(1)
+    print(f"\nNo significant slowdowns above {args.threshold:g}%.")
+
+
+if __name__ == "__main__":
+    main()
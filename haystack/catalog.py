@@ -0,0 +1,239 @@
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+# Caption tasks indexed for full-text search, in FTS column order
+caption_tasks = ("Caption", "Detailed Caption")
+
+# bm25 column weights: caption, detailed caption, labels
+rank_weights = (2.0, 1.0, 1.5)
+
+schema = """
+CREATE TABLE images (
+    id INTEGER PRIMARY KEY,
+    original_path TEXT NOT NULL,
+    annotated_path TEXT,
+    modal_title TEXT,
+    width INTEGER,
+    height INTEGER,
+    sha256 TEXT
+);
+CREATE TABLE tasks (
+    image_id INTEGER NOT NULL REFERENCES images (id),
+    task TEXT NOT NULL,
+    model TEXT NOT NULL,
+    result TEXT NOT NULL
+);
+CREATE TABLE detections (
+    image_id INTEGER NOT NULL REFERENCES images (id),
+    label TEXT NOT NULL,
+    x1 REAL, y1 REAL, x2 REAL, y2 REAL
+);
+CREATE VIRTUAL TABLE captions USING fts5 (
+    caption, detailed_caption, labels, tokenize = 'porter unicode61'
+);
+"""
+
+# Created after the bulk insert, which is faster than maintaining them per row
+indexes = """
+CREATE INDEX tasks_image ON tasks (image_id);
+CREATE INDEX tasks_model ON tasks (model, task);
+CREATE INDEX detections_label ON detections (label);
+CREATE INDEX detections_image ON detections (image_id);
+"""
+
+
+# Text of a task in a record's combined_json, e.g. {"Caption": {"Caption": "..."}}
+def task_text(combined_json, task):
+    value = combined_json.get(task)
+    if isinstance(value, dict):
+        value = value.get(task, "")
+    return value if isinstance(value, str) else ""
+
+
+# Words left out of search queries; they appear in nearly every caption
+stopwords = frozenset(
+    "a an and are as at be by for from in into is it near next of on or the there this to with".split()
+)
+
+
+# Turn free text such as "man with helmet near bicycle" into an FTS5 query:
+# stopwords are dropped (unless nothing else is left), every other word is
+# quoted so FTS5 operators are matched literally, and the words are joined
+# with AND, or with OR for the fallback when no caption has all of them
+def fts_query(text, operator="AND"):
+    words = re.findall(r"\w+", text.lower())
+    terms = [word for word in words if word not in stopwords] or words
+    return f" {operator} ".join(f'"{word}"' for word in terms)
+
+
+class CatalogWriter:
+    # Builds the SQLite catalog for one run: images, raw task results per
+    # model, detections and an FTS5 index over both caption types and the
+    # labels. Rows go to a temporary file that replaces the catalog on
+    # close(), so the server never sees a half-written catalog.
+    def __init__(self, path, model):
+        self.path = path
+        self.model = model
+        self.tmp_path = f"{path}.tmp"
+        if os.path.exists(self.tmp_path):
+            os.unlink(self.tmp_path)
+        self._db = sqlite3.connect(self.tmp_path)
+        self._db.execute("PRAGMA journal_mode=OFF")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.executescript(schema)
+
+    def add(self, image_id, record, labels, bboxes, entry=None):
+        combined_json = record["combined_json"]
+        self._db.execute(
+            "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                image_id,
+                record["original_path"],
+                record.get("annotated_path"),
+                record.get("modal_title"),
+                record.get("width"),
+                record.get("height"),
+                (entry or {}).get("sha256"),
+            ),
+        )
+        self._db.executemany(
+            "INSERT INTO tasks VALUES (?, ?, ?, ?)",
+            [(image_id, task, self.model, json.dumps(result)) for task, result in combined_json.items()],
+        )
+        self._db.executemany(
+            "INSERT INTO detections VALUES (?, ?, ?, ?, ?, ?)",
+            [(image_id, label, *bbox) for bbox, label in zip(bboxes, labels or [])],
+        )
+        self._db.execute(
+            "INSERT INTO captions (rowid, caption, detailed_caption, labels) VALUES (?, ?, ?, ?)",
+            (
+                image_id,
+                *(task_text(combined_json, task) for task in caption_tasks),
+                " ".join(labels or []),
+            ),
+        )
+
+    def close(self):
+        self._db.executescript(indexes)
+        self._db.execute("INSERT INTO captions (captions) VALUES ('optimize')")
+        self._db.commit()
+        self._db.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self._db.close()
+        os.unlink(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class Catalog:
+    # Read-only search over a catalog written by CatalogWriter. The
+    # connection is reopened whenever start.py replaces the file.
+    def __init__(self, path="catalog.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        self._version = None
+
+    def available(self):
+        return os.path.exists(self.path)
+
+    def _connect(self):
+        stat = os.stat(self.path)
+        version = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if version != self._version:
+            if self._db is not None:
+                self._db.close()
+            self._db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._version = version
+        return self._db
+
+    # Images matching free text, best bm25 score first. Images must contain
+    # every word; only when none does are images with any word returned
+    # ("matched": "any"). Scores are bm25 values negated so that higher is
+    # better.
+    def search(self, text, page=1, limit=24):
+        match = fts_query(text)
+        if not match:
+            raise ValueError("Search text must contain at least one word.")
+        page = max(1, page)
+        limit = max(1, min(limit, 500))
+        weights = ", ".join(str(w) for w in rank_weights)
+        matched = "all"
+        with self._lock:
+            db = self._connect()
+            total = db.execute(
+                "SELECT COUNT(*) FROM captions WHERE captions MATCH ?", (match,)
+            ).fetchone()[0]
+            if not total and " AND " in match:
+                match = fts_query(text, "OR")
+                matched = "any"
+                total = db.execute(
+                    "SELECT COUNT(*) FROM captions WHERE captions MATCH ?", (match,)
+                ).fetchone()[0]
+            rows = db.execute(
+                f"""
+                SELECT images.id, images.original_path, images.annotated_path, images.modal_title,
+                       snippet(captions, -1, '<b>', '</b>', '…', 12), -bm25(captions, {weights})
+                FROM captions JOIN images ON images.id = captions.rowid
+                WHERE captions MATCH ?
+                ORDER BY bm25(captions, {weights})
+                LIMIT ? OFFSET ?
+                """,
+                (match, limit, (page - 1) * limit),
+            ).fetchall()
+        return {
+            "query": text,
+            "matched": matched,
+            "total": total,
+            "page": page,
+            "limit": limit,
+            "pages": (total + limit - 1) // limit,
+            "images": [
+                {
+                    "id": row[0],
+                    "original_path": row[1],
+                    "annotated_path": row[2],
+                    "modal_title": row[3],
+                    "snippet": row[4],
+                    "score": round(row[5], 4),
+                }
+                for row in rows
+            ],
+        }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+if __name__ == "__main__":
+    # Usage: python catalog.py "man with helmet near bicycle"
+    if len(sys.argv) != 2:
+        print('Usage: python catalog.py "<search text>"')
+        sys.exit(1)
+
+    catalog = Catalog("catalog.sqlite")
+    if not catalog.available():
+        print("No catalog; run start.py --catalog first.")
+        sys.exit(1)
+    result = catalog.search(sys.argv[1], limit=20)
+    for image in result["images"]:
+        print(f"{image['score']:8.3f}  {image['original_path']}  {image['snippet']}")
+    words = "all words" if result["matched"] == "all" else "no image has all words; showing any word"
+    print(f"{result['total']} images match ({words}).")
@@ -0,0 +1,160 @@
+import argparse
+import os
+import numpy as np
+from PIL import Image
+
+# Near-duplicate detection with perceptual hashes. pHash (low frequencies of
+# a 32x32 DCT) survives re-encoding, resizing and small color changes; dHash
+# (brightness gradients of a 9x8 thumbnail) is cheap and catches different
+# structure that pHash can miss, so a match has to be close in both.
+
+hash_bits = 64
+phash_size = 32  # Side of the grayscale image the DCT is taken over
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    return np.cos(np.pi * (2 * x + 1) * k / (2 * n))
+
+
+_dct = _dct_matrix(phash_size)
+
+
+def _bits_to_hex(bits):
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return f"{value:016x}"
+
+
+def dhash(gray):
+    pixels = np.asarray(gray.resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    return _bits_to_hex(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(gray):
+    pixels = np.asarray(gray.resize((phash_size, phash_size), Image.LANCZOS), dtype=np.float64)
+    low = (_dct @ pixels @ _dct.T)[:8, :8]
+    median = np.median(low.ravel()[1:])  # The DC term only reflects overall brightness
+    return _bits_to_hex(low > median)
+
+
+# Perceptual fingerprint of an image file: both hashes (hex) plus its size,
+# which is needed to rescale reused boxes. JPEGs are decoded at reduced size.
+def image_fingerprint(image_path):
+    with Image.open(image_path) as img:
+        width, height = img.size
+        img.draft("L", (phash_size * 2, phash_size * 2))
+        gray = img.convert("L")
+    return {"phash": phash(gray), "dhash": dhash(gray), "width": width, "height": height}
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    # Burkhard-Keller tree over 64-bit hashes under Hamming distance. The
+    # triangle inequality prunes every child edge outside d - radius ..
+    # d + radius, so a lookup visits a small part of the tree.
+    def __init__(self):
+        self._root = None  # [hash, items, {distance: child}]
+        self._size = 0
+
+    def add(self, value, item):
+        self._size += 1
+        if self._root is None:
+            self._root = [value, [item], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    # (distance, item) of every entry within radius
+    def search(self, value, radius):
+        matches = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                matches.extend((distance, item) for item in node[1])
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return matches
+
+    def __len__(self):
+        return self._size
+
+
+class DuplicateIndex:
+    # Images whose results can be reused, keyed by pHash in a BK-tree. A
+    # candidate is a duplicate when both hashes are within max_distance bits
+    # and the aspect ratio matches (boxes are rescaled per axis).
+    def __init__(self, max_distance=6, max_aspect_change=0.02):
+        self.max_distance = max_distance
+        self.max_aspect_change = max_aspect_change
+        self.images = {}  # image_path -> (fingerprint, sha256)
+        self._tree = BKTree()
+
+    def add(self, image_path, fingerprint, sha256=None):
+        self.images[image_path] = (fingerprint, sha256)
+        self._tree.add(int(fingerprint["phash"], 16), image_path)
+
+    # Closest indexed image as (image_path, distance), or None
+    def find(self, fingerprint):
+        dhash_value = int(fingerprint["dhash"], 16)
+        aspect = fingerprint["width"] / fingerprint["height"]
+        best = None
+        for distance, image_path in self._tree.search(int(fingerprint["phash"], 16), self.max_distance):
+            other = self.images[image_path][0]
+            if hamming(dhash_value, int(other["dhash"], 16)) > self.max_distance:
+                continue
+            other_aspect = other["width"] / other["height"]
+            if abs(aspect - other_aspect) > self.max_aspect_change * other_aspect:
+                continue
+            if best is None or distance < best[1]:
+                best = (image_path, distance)
+        return best
+
+    def __len__(self):
+        return len(self._tree)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="List near-duplicate images in a directory.")
+    parser.add_argument("directory", nargs="?", default="./images/")
+    parser.add_argument("--distance", type=int, default=6, help="Max differing bits (of 64) per hash")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    index = DuplicateIndex(args.distance)
+    duplicates = 0
+    for name in sorted(os.listdir(args.directory)):
+        if not name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+            continue
+        image_path = os.path.join(args.directory, name)
+        fingerprint = image_fingerprint(image_path)
+        match = index.find(fingerprint)
+        if match is None:
+            index.add(image_path, fingerprint)
+        else:
+            duplicates += 1
+            print(f"{image_path} ~ {match[0]} ({match[1]} bits)")
+    print(f"{duplicates} near-duplicates, {len(index)} distinct images")
+
+
+if __name__ == "__main__":
+    main()
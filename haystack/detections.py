@@ -0,0 +1,144 @@
+import json
+import os
+import sys
+from array import array
+import numpy as np
+
+# Columns of the store: one row per detected box
+columns = {
+    "image_id": np.uint32,
+    "label_id": np.uint32,
+    "x1": np.float32,
+    "y1": np.float32,
+    "x2": np.float32,
+    "y2": np.float32,
+}
+array_codes = {np.uint32: "I", np.float32: "f"}
+
+
+class DetectionStore:
+    # Columnar store of every Object Detection box: image IDs (positions in
+    # image_data.json), interned label IDs and box corners as typed arrays.
+    # Each column is saved as its own .npy file, so a large store can be
+    # memory-mapped and aggregated with vectorized NumPy operations instead
+    # of loading the nested JSON.
+    def __init__(self):
+        self.labels = []
+        self.label_ids = {}
+        self.image_count = 0
+        self._rows = {name: array(array_codes[dtype]) for name, dtype in columns.items()}
+        self._columns = None
+
+    def add(self, image_id, bboxes, labels):
+        self.image_count = max(self.image_count, image_id + 1)
+        rows = self._rows
+        for (x1, y1, x2, y2), label in zip(bboxes, labels):
+            label_id = self.label_ids.get(label)
+            if label_id is None:
+                label_id = len(self.labels)
+                self.label_ids[label] = label_id
+                self.labels.append(label)
+            rows["image_id"].append(image_id)
+            rows["label_id"].append(label_id)
+            rows["x1"].append(x1)
+            rows["y1"].append(y1)
+            rows["x2"].append(x2)
+            rows["y2"].append(y2)
+        self._columns = None
+
+    # Column arrays by name; copies of the build buffers, or the mapped files
+    @property
+    def columns(self):
+        if self._columns is None:
+            self._columns = {
+                name: np.frombuffer(self._rows[name], dtype=dtype).copy()
+                for name, dtype in columns.items()
+            }
+        return self._columns
+
+    def __len__(self):
+        return len(self.columns["image_id"])
+
+    def areas(self):
+        c = self.columns
+        return (c["x2"] - c["x1"]) * (c["y2"] - c["y1"])
+
+    # Boxes per label, in label ID order
+    def counts(self):
+        return np.bincount(self.columns["label_id"], minlength=len(self.labels))
+
+    # Treemap counts: detections per label, keyed by label
+    def label_counts(self):
+        return {label: int(count) for label, count in zip(self.labels, self.counts()) if count}
+
+    # Distinct images each label was detected in
+    def image_counts(self):
+        c = self.columns
+        stride = max(self.image_count, 1)
+        pairs = np.unique(c["label_id"].astype(np.int64) * stride + c["image_id"])
+        return np.bincount(pairs // stride, minlength=len(self.labels))
+
+    def area_by_label(self):
+        return np.bincount(
+            self.columns["label_id"], weights=self.areas(), minlength=len(self.labels)
+        )
+
+    def boxes_per_image(self):
+        return np.bincount(self.columns["image_id"], minlength=self.image_count)
+
+    # Row mask for one label (empty when it was never detected)
+    def label_mask(self, label):
+        label_id = self.label_ids.get(label)
+        if label_id is None:
+            return np.zeros(len(self), dtype=bool)
+        return self.columns["label_id"] == label_id
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name, column in self.columns.items():
+            np.save(os.path.join(path, f"{name}.npy"), column)
+        with open(os.path.join(path, "labels.json"), "w") as f:
+            json.dump({"image_count": self.image_count, "labels": self.labels}, f)
+
+    # mmap=True maps the columns read-only instead of reading them into memory
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, "labels.json"), "r") as f:
+            data = json.load(f)
+        store = cls()
+        store.image_count = data["image_count"]
+        store.labels = data["labels"]
+        store.label_ids = {label: i for i, label in enumerate(store.labels)}
+        store._columns = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in columns
+        }
+        return store
+
+    def summary(self):
+        rows = []
+        counts = self.counts()
+        images = self.image_counts()
+        areas = self.area_by_label()
+        for label_id in np.argsort(-counts, kind="stable"):
+            if counts[label_id]:
+                rows.append(
+                    {
+                        "label": self.labels[label_id],
+                        "boxes": int(counts[label_id]),
+                        "images": int(images[label_id]),
+                        "mean_area": float(areas[label_id] / counts[label_id]),
+                    }
+                )
+        return rows
+
+
+if __name__ == "__main__":
+    # Usage: python detections.py [detections_dir]
+    store = DetectionStore.load(sys.argv[1] if len(sys.argv) > 1 else "detections")
+    print(f"{len(store)} boxes across {store.image_count} images")
+    for row in store.summary():
+        print(
+            f"  {row['label']}: {row['boxes']} boxes in {row['images']} images, "
+            f"mean area {row['mean_area']:.0f} px"
+        )
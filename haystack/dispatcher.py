@@ -0,0 +1,188 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AdaptiveLimit:
+    # AIMD control of the number of requests in flight. The baseline is the
+    # lowest latency among the last `window` requests, roughly the service
+    # time of an idle server. A request slower than tolerance x baseline
+    # means requests are queueing at the server, so the limit is multiplied
+    # by backoff (error_backoff on errors and timeouts); otherwise it grows
+    # by one per limit's worth of successes, but only while the limit is
+    # actually reached. At most one decrease per round trip: requests started
+    # before the last decrease saw the old limit and are ignored.
+    def __init__(
+        self, initial, min_limit=1, max_limit=64, tolerance=2.0, backoff=0.9, error_backoff=0.5, window=100
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.error_backoff = error_backoff
+        self._latencies = deque(maxlen=window)
+        self._last_decrease = 0.0
+        self.lowest = self.highest = int(self.limit)
+        self.increases = 0
+        self.decreases = 0
+
+    def baseline(self):
+        return min(self._latencies) if self._latencies else None
+
+    def _decrease(self, factor, started, now):
+        if started < self._last_decrease:
+            return
+        self.limit = max(self.min_limit, self.limit * factor)
+        self._last_decrease = now
+        self.decreases += 1
+        self.lowest = min(self.lowest, int(self.limit))
+
+    # One finished request: its start (perf_counter), latency in seconds,
+    # whether it failed, and how many requests were in flight including it
+    def update(self, started, latency, failed, in_flight):
+        now = started + latency
+        if failed:
+            self._decrease(self.error_backoff, started, now)
+            return
+        self._latencies.append(latency)
+        if latency > self.tolerance * self.baseline():
+            self._decrease(self.backoff, started, now)
+        elif in_flight >= int(self.limit) and self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.increases += 1
+            self.highest = max(self.highest, int(self.limit))
+
+
+class InferenceDispatcher:
+    # Runs Florence jobs on a thread pool while capping how many are in flight.
+    # submit() blocks once the cap is reached, so the caller can't queue the
+    # whole corpus up front (backpressure). With adaptive=True the cap moves
+    # between min_in_flight and max_in_flight with observed latency
+    # (AdaptiveLimit); otherwise it stays at max_in_flight. Jobs report each
+    # remote call through observe(), so local work such as preparing an
+    # upload isn't mistaken for server load; jobs that report nothing are
+    # measured as a whole.
+    def __init__(self, max_workers=4, max_in_flight=8, adaptive=False, min_in_flight=1, throughput_window=10.0):
+        self.max_workers = max(1, max_workers)
+        self.max_in_flight = max(1, max_in_flight)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="florence"
+        )
+        self._lock = threading.Lock()
+        self._slot_free = threading.Condition(self._lock)
+        self.controller = None
+        if adaptive:
+            self.controller = AdaptiveLimit(
+                initial=max(min_in_flight, self.max_in_flight // 2),
+                min_limit=min_in_flight,
+                max_limit=self.max_in_flight,
+            )
+        self.throughput_window = throughput_window
+        self._finished = deque()  # perf_counter of recent completions, for throughput
+        self._started = time.perf_counter()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.calls = 0
+        self.total_latency = 0.0
+        self._local = threading.local()
+
+    # Current cap on requests in flight
+    def limit(self):
+        return int(self.controller.limit) if self.controller is not None else self.max_in_flight
+
+    def submit(self, fn, *args, **kwargs):
+        with self._slot_free:
+            while self.in_flight >= self.limit():  # Wait for a free slot
+                self._slot_free.wait()
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return self._executor.submit(self._run, fn, args, kwargs)
+        except Exception:
+            self._release(failed=True)
+            raise
+
+    def _run(self, fn, args, kwargs):
+        failed = True
+        self._local.observed = False
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            self._release(failed, None if self._local.observed else started)
+
+    # Record one remote call of the running job: its perf_counter start and
+    # end and whether it failed (retried attempts included)
+    def observe(self, started, ended, failed=False):
+        self._local.observed = True
+        with self._slot_free:
+            self._sample(started, ended, failed)
+            self._slot_free.notify_all()  # The limit may have grown
+
+    def _sample(self, started, ended, failed):
+        if self.controller is not None:
+            self.controller.update(started, ended - started, failed, self.in_flight)
+        if not failed:
+            self.calls += 1
+            self.total_latency += ended - started
+
+    def _release(self, failed, started=None):
+        now = time.perf_counter()
+        with self._slot_free:
+            if started is not None:
+                self._sample(started, now, failed)
+            self.in_flight -= 1
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+                self._finished.append(now)
+            self._slot_free.notify_all()  # The limit may have grown by more than one
+
+    # Completed requests per second over the last throughput_window seconds
+    def _throughput(self, now):
+        while self._finished and self._finished[0] < now - self.throughput_window:
+            self._finished.popleft()
+        span = min(self.throughput_window, now - self._started)
+        return len(self._finished) / span if span > 0 else 0.0
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "workers": self.max_workers,
+                "max_in_flight": self.max_in_flight,
+                "limit": self.limit(),
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "completed": self.completed,
+                "failed": self.failed,
+                "throughput": self._throughput(time.perf_counter()),
+                "mean_latency": self.total_latency / self.calls if self.calls else 0.0,
+            }
+            if self.controller is not None:
+                stats.update(
+                    {
+                        "min_in_flight": self.controller.min_limit,
+                        "lowest_limit": self.controller.lowest,
+                        "highest_limit": self.controller.highest,
+                        "limit_decreases": self.controller.decreases,
+                        "baseline_latency": self.controller.baseline(),
+                    }
+                )
+            return stats
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown(wait=exc_type is None)
+        return False
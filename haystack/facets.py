@@ -0,0 +1,196 @@
+import base64
+import json
+import os
+import re
+import sys
+
+# Tokens of a label query: parentheses, quoted labels and bare words
+token_pattern = re.compile(r'\(|\)|"[^"]*"|[^\s()"]+')
+operators = ("AND", "OR", "NOT")
+
+
+class LabelIndex:
+    # Label facet index: labels are interned to integer IDs and each label
+    # keeps a bitmap of the image IDs (positions in image_data.json) it was
+    # detected in. Bits are set in bytearrays while building; queries run on
+    # Python ints, so AND/OR/NOT across labels are single big-integer
+    # operations instead of a scan over every image.
+    def __init__(self):
+        self.labels = []
+        self.label_ids = {}
+        self.image_count = 0
+        self._bits = []
+        self._bitmaps = None
+
+    def add(self, image_id, labels):
+        self.image_count = max(self.image_count, image_id + 1)
+        byte_index = image_id >> 3
+        for label in set(labels or []):
+            key = label.lower()
+            label_id = self.label_ids.get(key)
+            if label_id is None:
+                label_id = len(self.labels)
+                self.label_ids[key] = label_id
+                self.labels.append(label)
+                self._bits.append(bytearray())
+            bits = self._bits[label_id]
+            if len(bits) <= byte_index:
+                bits.extend(bytes(byte_index + 1 - len(bits)))
+            bits[byte_index] |= 1 << (image_id & 7)
+        self._bitmaps = None
+
+    @property
+    def bitmaps(self):
+        if self._bitmaps is None:
+            self._bitmaps = [int.from_bytes(bits, "little") for bits in self._bits]
+        return self._bitmaps
+
+    def bitmap(self, label):
+        label_id = self.label_ids.get(label.lower())
+        return 0 if label_id is None else self.bitmaps[label_id]
+
+    def all_images(self):
+        return (1 << self.image_count) - 1
+
+    # Evaluate a query such as: person AND (bicycle OR "traffic light") AND NOT car
+    # Adjacent words form one multi-word label; operators are case-insensitive.
+    def query(self, expression):
+        tokens = token_pattern.findall(expression)
+        position = 0
+
+        def peek():
+            return tokens[position] if position < len(tokens) else None
+
+        def is_operator(token, name):
+            return token is not None and token.upper() == name
+
+        def parse_or():
+            nonlocal position
+            result = parse_and()
+            while is_operator(peek(), "OR"):
+                position += 1
+                result |= parse_and()
+            return result
+
+        def parse_and():
+            nonlocal position
+            result = parse_not()
+            while is_operator(peek(), "AND"):
+                position += 1
+                result &= parse_not()
+            return result
+
+        def parse_not():
+            nonlocal position
+            if is_operator(peek(), "NOT"):
+                position += 1
+                return self.all_images() & ~parse_not()
+            if peek() == "(":
+                position += 1
+                result = parse_or()
+                if peek() != ")":
+                    raise ValueError(f"Missing ')' in query: {expression}")
+                position += 1
+                return result
+            return parse_label()
+
+        def parse_label():
+            nonlocal position
+            token = peek()
+            if token is None or token == ")" or token.upper() in operators:
+                raise ValueError(f"Expected a label in query: {expression}")
+            if token.startswith('"'):
+                position += 1
+                return self.bitmap(token.strip('"'))
+            words = []
+            while peek() not in (None, "(", ")") and peek().upper() not in operators:
+                if peek().startswith('"'):
+                    break
+                words.append(peek())
+                position += 1
+            return self.bitmap(" ".join(words))
+
+        if not tokens:
+            return self.all_images()
+        result = parse_or()
+        if position != len(tokens):
+            raise ValueError(f"Unexpected '{tokens[position]}' in query: {expression}")
+        return result
+
+    @staticmethod
+    def image_ids(bitmap):
+        ids = []
+        data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+        for byte_index, byte in enumerate(data):
+            while byte:
+                low_bit = byte & -byte
+                ids.append(byte_index * 8 + low_bit.bit_length() - 1)
+                byte ^= low_bit
+        return ids
+
+    def counts(self):
+        return {label: bitmap.bit_count() for label, bitmap in zip(self.labels, self.bitmaps)}
+
+    # Bitmaps are stored as base64 little-endian bytes padded to 32-bit words,
+    # so the viewer can load them straight into a Uint32Array
+    def save(self, path):
+        size = (self.image_count + 31) // 32 * 4
+        data = {
+            "image_count": self.image_count,
+            "labels": self.labels,
+            "bitmaps": [
+                base64.b64encode(bytes(bits) + bytes(size - len(bits))).decode("ascii")
+                for bits in self._bits
+            ],
+        }
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            data = json.load(f)
+        index = cls()
+        index.image_count = data["image_count"]
+        index.labels = data["labels"]
+        index.label_ids = {label.lower(): i for i, label in enumerate(index.labels)}
+        index._bits = [bytearray(base64.b64decode(bitmap)) for bitmap in data["bitmaps"]]
+        return index
+
+
+# Original paths of the given image IDs, from image_data.json or, after a
+# --shards run, from the shards listed in gallery/manifest.json (each shard
+# is read at most once)
+def original_paths(image_ids, data_json="image_data.json", gallery_manifest="gallery/manifest.json"):
+    if os.path.exists(data_json):
+        with open(data_json, "r") as json_file:
+            images = json.load(json_file)["images"]
+        return [images[image_id]["original_path"] for image_id in image_ids]
+    if not os.path.exists(gallery_manifest):
+        raise SystemExit("No gallery data; run start.py first.")
+    with open(gallery_manifest, "r") as f:
+        manifest = json.load(f)
+    shards = {}
+    paths = []
+    for image_id in image_ids:
+        shard = image_id // manifest["shard_size"]
+        if shard not in shards:
+            shard_path = os.path.join(os.path.dirname(gallery_manifest), manifest["shards"][shard]["path"])
+            with open(shard_path, "r") as f:
+                shards[shard] = json.load(f)
+        data = shards[shard]
+        paths.append(data["images"][image_id - data["start"]]["original_path"])
+    return paths
+
+
+if __name__ == "__main__":
+    # Usage: python facets.py "person AND NOT car"
+    if len(sys.argv) != 2:
+        print('Usage: python facets.py "<label query>"')
+        sys.exit(1)
+
+    index = LabelIndex.load("label_index.json")
+    matches = index.image_ids(index.query(sys.argv[1]))
+    for path in original_paths(matches):
+        print(path)
+    print(f"{len(matches)} of {index.image_count} images match.")
@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+from facets import LabelIndex
+
+# Sort orders supported by GalleryIndex.query
+sort_keys = ("id", "name", "labels", "modified")
+
+
+class StaleIndexError(RuntimeError):
+    # The results log, manifest and label index are not from the same run,
+    # e.g. while start.py is rewriting them
+    pass
+
+
+class GalleryIndex:
+    # Read-only query index over the files written by start.py. Only small
+    # per-image keys are held in memory: the byte offset of every record in
+    # the results log (line i is image ID i), the paths, label counts and
+    # mtimes from the manifest, and the label facet bitmaps. Records are read
+    # from the log on demand, so serving a page costs the same regardless of
+    # the size of the gallery. Line i of the log, entry i of the manifest and
+    # bit i of the label bitmaps only describe the same image once start.py
+    # has finished, so the index is only used when the manifest's
+    # results_log_size matches the log and every record read is checked
+    # against its path.
+    def __init__(
+        self,
+        results_log="image_results.jsonl",
+        manifest_json="image_manifest.json",
+        label_index_json="label_index.json",
+        query_cache_size=32,
+    ):
+        self.results_log = results_log
+        self.manifest_json = manifest_json
+        self.label_index_json = label_index_json
+        self.query_cache_size = query_cache_size
+        self._lock = threading.Lock()
+        self._version = None
+        self.offsets = array("Q")
+        self.paths = []
+        self.detections = array("I")
+        self.mtimes = array("d")
+        self.label_index = None
+        self.consistent = False
+        self._orders = {}
+        self._query_cache = OrderedDict()
+
+    def available(self):
+        return os.path.exists(self.results_log) and os.path.exists(self.manifest_json)
+
+    def _current_version(self):
+        versions = []
+        for path in (self.results_log, self.manifest_json, self.label_index_json):
+            try:
+                stat = os.stat(path)
+                versions.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                versions.append(None)
+        return tuple(versions)
+
+    # Load the index, or reload it if start.py rewrote its outputs
+    def refresh(self):
+        version = self._current_version()
+        with self._lock:
+            if version == self._version:
+                return
+            self._load()
+            self._version = version
+
+    def _load(self):
+        offsets = array("Q")
+        position = 0
+        with open(self.results_log, "rb") as f:
+            for line in f:
+                offsets.append(position)
+                position += len(line)
+
+        with open(self.manifest_json, "r") as f:
+            manifest = json.load(f)
+        entries = manifest["images"]
+
+        if os.path.exists(self.label_index_json):
+            self.label_index = LabelIndex.load(self.label_index_json)
+        else:
+            self.label_index = None
+
+        self.consistent = (
+            manifest.get("results_log_size") == position
+            and len(offsets) == len(entries)
+            and (self.label_index is None or self.label_index.image_count == len(entries))
+        )
+        self.offsets = offsets if self.consistent else array("Q")
+        self.paths = []
+        self.detections = array("I")
+        self.mtimes = array("d")
+        if self.consistent:
+            for image_path, entry in entries.items():
+                self.paths.append(image_path)
+                self.detections.append(len(entry.get("labels") or []))
+                self.mtimes.append(entry.get("mtime", 0.0))
+        self._orders = {}
+        self._query_cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    # Image IDs in the given sort order, computed once per load
+    def _order(self, sort):
+        order = self._orders.get(sort)
+        if order is None:
+            ids = range(len(self.offsets))
+            if sort == "name":
+                order = sorted(ids, key=lambda i: os.path.basename(self.paths[i]).lower())
+            elif sort == "labels":
+                order = sorted(ids, key=lambda i: self.detections[i])
+            elif sort == "modified":
+                order = sorted(ids, key=lambda i: self.mtimes[i])
+            else:
+                order = list(ids)
+            self._orders[sort] = order
+        return order
+
+    # Matching image IDs for a label query in sort order (cached per query)
+    def matching_ids(self, label_query=None, sort="id", descending=False):
+        key = (label_query or "", sort, descending)
+        with self._lock:
+            cached = self._query_cache.get(key)
+            if cached is not None:
+                self._query_cache.move_to_end(key)
+                return cached
+
+            order = self._order(sort)
+            if label_query:
+                if self.label_index is None:
+                    raise ValueError("No label index available; run start.py first.")
+                bitmap = self.label_index.query(label_query)
+                if sort == "id":
+                    ids = [i for i in self.label_index.image_ids(bitmap) if i < len(order)]
+                else:
+                    bits = bitmap.to_bytes((len(order) + 7) // 8, "little")
+                    ids = [i for i in order if bits[i >> 3] >> (i & 7) & 1]
+            else:
+                ids = order
+            if descending:
+                ids = ids[::-1]
+
+            self._query_cache[key] = ids
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+            return ids
+
+    # Read the records of the given image IDs from the results log
+    def records(self, ids, fields=None):
+        records = []
+        with open(self.results_log, "rb") as f:
+            for image_id in ids:
+                f.seek(self.offsets[image_id])
+                line = f.readline()
+                item = json.loads(line) if line.endswith(b"\n") else None
+                if item is None or item["record"]["original_path"] != self.paths[image_id]:
+                    raise StaleIndexError("The gallery changed while it was read; try again.")
+                record = dict(item["record"], labels=item["labels"] or [])
+                if fields:
+                    record = {k: record[k] for k in fields if k in record}
+                record["id"] = image_id
+                records.append(record)
+        return records
+
+    def query(self, page=1, limit=24, label=None, sort="id", order="asc", fields=None):
+        if sort not in sort_keys:
+            raise ValueError(f"Unknown sort '{sort}'; expected one of {', '.join(sort_keys)}.")
+        self.refresh()
+        if not self.consistent:
+            raise StaleIndexError("The gallery is being rebuilt by start.py; try again when it finishes.")
+        ids = self.matching_ids(label, sort, order == "desc")
+        page = max(1, page)
+        limit = max(1, min(limit, 500))
+        start = (page - 1) * limit
+        return {
+            "total": len(ids),
+            "page": page,
+            "limit": limit,
+            "pages": (len(ids) + limit - 1) // limit,
+            "images": self.records(ids[start : start + limit], fields),
+        }
@@ -0,0 +1,27 @@
+import math
+
+# Percentiles reported for every latency distribution
+reported_percentiles = (50, 90, 99)
+
+
+# Percentile of already sorted values, interpolating linearly between ranks
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * q / 100
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+# Count, mean, p50/p90/p99 and max of a list of durations in seconds
+def summarize(values):
+    values = sorted(values)
+    summary = {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+    }
+    for q in reported_percentiles:
+        summary[f"p{q}"] = percentile(values, q)
+    summary["max"] = values[-1] if values else 0.0
+    return summary
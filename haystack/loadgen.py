@@ -0,0 +1,206 @@
+import os
+import math
+import time
+import random
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from gradio_client import handle_file
+from prettytable import PrettyTable
+from backends import BackendPool, endpoints_from_env
+from latency import summarize
+
+# Defaults match benchmark.py
+benchmark_dir = "./benchmark"
+resolutions = ["720p", "1080p", "1440p", "4k"]
+supported_formats = (".jpg", ".jpeg", ".png", ".webp")
+florence_model = "microsoft/Florence-2-base-ft"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Open-loop load generator for Florence endpoints: requests are sent "
+        "at a target arrival rate regardless of how fast earlier ones complete."
+    )
+    parser.add_argument(
+        "--rate",
+        default="1",
+        help="Offered load in requests/s; a comma-separated list ramps through each rate in turn",
+    )
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per rate")
+    parser.add_argument(
+        "--arrivals",
+        choices=["poisson", "constant"],
+        default="poisson",
+        help="Poisson (exponential gaps) or evenly spaced arrivals",
+    )
+    parser.add_argument("--model", default=florence_model, help="Florence model to load test")
+    parser.add_argument("--task", default="Object Detection", help="Task prompt to send")
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=256,
+        help="Client threads; arrivals beyond this queue on the client and show up as queueing delay",
+    )
+    parser.add_argument("--sla", type=float, default=0.0, help="p99 response time target in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for arrivals and image choice")
+    parser.add_argument(
+        "--endpoint",
+        action="append",
+        metavar="URL",
+        help="Florence server URL; repeat to balance across several servers",
+    )
+    return parser.parse_args()
+
+
+# Images of every resolution folder in benchmark/, as (resolution, path)
+def collect_images():
+    images = []
+    for resolution in resolutions:
+        folder = os.path.join(benchmark_dir, resolution)
+        if os.path.isdir(folder):
+            images.extend(
+                (resolution, os.path.join(folder, f))
+                for f in sorted(os.listdir(folder))
+                if f.lower().endswith(supported_formats)
+            )
+    if not images:
+        raise FileNotFoundError(f"No benchmark images found in {benchmark_dir}.")
+    return images
+
+
+# Arrival offsets (seconds from the start of a stage) for one offered rate
+def arrival_times(rate, duration, arrivals, rng):
+    if arrivals == "constant":
+        return [i / rate for i in range(math.ceil(duration * rate))]
+    times = []
+    t = rng.expovariate(rate)
+    while t < duration:
+        times.append(t)
+        t += rng.expovariate(rate)
+    return times
+
+
+# Send one request. Queueing delay is the time between its scheduled arrival
+# and a client thread picking it up; latency is the request itself.
+def send_request(pool, image_path, model_id, task_prompt, scheduled):
+    start_time = time.perf_counter()
+    error = None
+    try:
+        pool.predict(
+            image=handle_file(image_path),
+            task_prompt=task_prompt,
+            text_input=None,
+            model_id=model_id,
+            api_name="/process_image",
+        )
+    except Exception as e:
+        error = repr(e)
+    end_time = time.perf_counter()
+    return {
+        "queue": start_time - scheduled,
+        "latency": end_time - start_time,
+        "response": end_time - scheduled,
+        "end": end_time,
+        "error": error,
+    }
+
+
+# Run every stage of the ramp back to back without waiting for stragglers;
+# each request is attributed to the stage it arrived in
+def run_load(pool, images, rates, args):
+    rng = random.Random(args.seed)
+    requests = []  # (stage, resolution, scheduled, future)
+    with ThreadPoolExecutor(max_workers=args.max_in_flight, thread_name_prefix="load") as executor:
+        stage_start = time.perf_counter()
+        for stage, rate in enumerate(rates):
+            print(f"Offering {rate:g} req/s for {args.duration:g}s ({args.arrivals} arrivals)")
+            for offset in arrival_times(rate, args.duration, args.arrivals, rng):
+                scheduled = stage_start + offset
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                resolution, image_path = rng.choice(images)
+                future = executor.submit(
+                    send_request, pool, image_path, args.model, args.task, scheduled
+                )
+                requests.append((stage, resolution, scheduled, future))
+            stage_start += args.duration
+            delay = stage_start - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        print("Waiting for outstanding requests...")
+    return [(stage, resolution, scheduled, future.result()) for stage, resolution, scheduled, future in requests]
+
+
+def report(results, rates, duration, sla):
+    table = PrettyTable()
+    table.field_names = [
+        "Offered (req/s)", "Resolution", "Sent", "Achieved (req/s)", "Errors",
+        "Queue p50 (s)", "Queue p99 (s)", "Latency p50 (s)", "Latency p90 (s)",
+        "Latency p99 (s)", "Latency max (s)", "Response p99 (s)",
+    ]
+    table.align = "r"
+    sla_met = []
+    for index, rate in enumerate(rates):
+        stage = [r for r in results if r[0] == index]
+        groups = [("all", stage)] + [
+            (resolution, [r for r in stage if r[1] == resolution])
+            for resolution in resolutions
+            if any(r[1] == resolution for r in stage)
+        ]
+        for resolution, group in groups:
+            ok = [r[3] for r in group if r[3]["error"] is None]
+            errors = len(group) - len(ok)
+            if group:
+                span = max(r[3]["end"] for r in group) - min(r[2] for r in group)
+            else:
+                span = duration
+            queue = summarize([r["queue"] for r in ok])
+            latency = summarize([r["latency"] for r in ok])
+            response = summarize([r["response"] for r in ok])
+            table.add_row(
+                [
+                    f"{rate:g}" if resolution == "all" else "",
+                    resolution,
+                    len(group),
+                    f"{len(ok) / max(span, duration):.2f}",
+                    f"{errors} ({errors / len(group) * 100 if group else 0:.1f}%)",
+                    f"{queue['p50']:.3f}",
+                    f"{queue['p99']:.3f}",
+                    f"{latency['p50']:.3f}",
+                    f"{latency['p90']:.3f}",
+                    f"{latency['p99']:.3f}",
+                    f"{latency['max']:.3f}",
+                    f"{response['p99']:.3f}",
+                ]
+            )
+            if resolution == "all" and sla and ok and not errors and response["p99"] <= sla:
+                sla_met.append(rate)
+    print(table)
+
+    if sla:
+        if sla_met:
+            print(f"Highest offered load meeting a {sla:g}s p99 SLA without errors: {max(sla_met):g} req/s")
+        else:
+            print(f"No offered load met a {sla:g}s p99 SLA without errors.")
+
+
+def main():
+    args = parse_args()
+    rates = [float(rate) for rate in args.rate.split(",") if rate.strip()]
+    if not rates or min(rates) <= 0:
+        raise ValueError("Rates must be positive numbers.")
+
+    images = collect_images()
+    pool = BackendPool(args.endpoint or endpoints_from_env(["http://127.0.0.1:7860/"]))
+    pool.start_health_checks()
+    try:
+        results = run_load(pool, images, rates, args)
+    finally:
+        print(pool.report())
+        pool.close()
+    report(results, rates, args.duration, args.sla)
+
+
+if __name__ == "__main__":
+    main()
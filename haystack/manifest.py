@@ -0,0 +1,58 @@
+import json
+import os
+
+from result_cache import file_digest
+
+
+# Load the manifest written by the previous run, or an empty one
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {"images": {}, "label_counts": {}}
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    manifest.setdefault("images", {})
+    manifest.setdefault("label_counts", {})
+    return manifest
+
+
+# Write the manifest atomically so a crash never leaves a truncated file
+def save_manifest(path, manifest):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+# Compare the images on disk with the manifest entries from the last run.
+# Files whose size and mtime are unchanged are trusted without hashing; the
+# rest are hashed so a touched-but-identical file is not reprocessed.
+def scan_images(image_paths, previous_entries):
+    changes = {"added": [], "modified": [], "unchanged": [], "deleted": [], "entries": {}}
+
+    for image_path in image_paths:
+        stat = os.stat(image_path)
+        entry = {"mtime": stat.st_mtime, "size": stat.st_size}
+        previous = previous_entries.get(image_path)
+
+        if previous and previous["mtime"] == entry["mtime"] and previous["size"] == entry["size"]:
+            entry["sha256"] = previous["sha256"]
+            changes["unchanged"].append(image_path)
+        else:
+            entry["sha256"] = file_digest(image_path)
+            if previous is None:
+                changes["added"].append(image_path)
+            elif previous["sha256"] == entry["sha256"]:
+                changes["unchanged"].append(image_path)
+            else:
+                changes["modified"].append(image_path)
+
+        if previous is not None:
+            entry["labels"] = previous.get("labels")
+            # Perceptual hashes (--dedup) stay valid while the content does
+            if previous.get("fingerprint") and previous["sha256"] == entry["sha256"]:
+                entry["fingerprint"] = previous["fingerprint"]
+        changes["entries"][image_path] = entry
+
+    current = set(image_paths)
+    changes["deleted"] = [p for p in previous_entries if p not in current]
+    return changes
@@ -0,0 +1,198 @@
+import argparse
+import hashlib
+import math
+import random
+import threading
+import time
+from PIL import Image
+
+try:
+    import gradio as gr  # Optional; only needed to run the mock server
+except ImportError:
+    gr = None
+
+# Stand-in for the Florence-2 Gradio app: same /process_image endpoint and
+# the same repr-formatted results, with synthetic but deterministic content
+# (seeded by the image bytes) and configurable latency and failures, so the
+# client pipeline can be benchmarked without a GPU.
+
+task_tokens = {
+    "Caption": "<CAPTION>",
+    "Detailed Caption": "<DETAILED_CAPTION>",
+    "More Detailed Caption": "<MORE_DETAILED_CAPTION>",
+    "Object Detection": "<OD>",
+}
+models = [
+    "microsoft/Florence-2-large-ft",
+    "microsoft/Florence-2-large",
+    "microsoft/Florence-2-base-ft",
+    "microsoft/Florence-2-base",
+]
+objects = [
+    "person", "bicycle", "car", "bus", "dog", "cat", "helmet", "backpack", "tree",
+    "building", "bench", "traffic light", "umbrella", "bicycle wheel", "footwear",
+]
+adjectives = ["red", "old", "small", "busy", "quiet", "large", "colorful", "wet"]
+places = ["on a street", "in a park", "in front of a building", "near the road", "at night"]
+
+
+# Latency distribution from a spec such as "lognormal:0.8,0.4" (median,
+# sigma), "normal:1.0,0.2", "uniform:0.5,1.5", "exponential:1.0" (mean) or
+# "fixed:0.5". Returns a function drawing seconds from an RNG.
+def parse_latency(spec):
+    name, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v.strip()]
+    if name == "fixed":
+        return lambda rng: values[0]
+    if name == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if name == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if name == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    if name == "exponential":
+        return lambda rng: rng.expovariate(1.0 / values[0])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def image_seed(image_path, seed):
+    digest = hashlib.sha256(str(seed).encode("utf-8"))
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return int.from_bytes(digest.digest()[:8], "big")
+
+
+# Florence-style result for one task, as the repr string the real app returns
+def fake_result(task_token, rng, width, height):
+    main, other = rng.sample(objects, 2)
+    if task_token == "<CAPTION>":
+        text = f"A {rng.choice(adjectives)} {main} {rng.choice(places)}."
+        return str({task_token: text})
+    if task_token in ("<DETAILED_CAPTION>", "<MORE_DETAILED_CAPTION>"):
+        text = (
+            f"In this image we can see a {main} and a {other} {rng.choice(places)}. "
+            f"The {main} is {rng.choice(adjectives)}. In the background, we can see a "
+            f"{rng.choice(objects)} and a {rng.choice(objects)}."
+        )
+        return str({task_token: text})
+    if task_token == "<OD>":
+        bboxes = []
+        labels = []
+        for _ in range(rng.randint(1, 8)):
+            x1 = rng.uniform(0, width * 0.8)
+            y1 = rng.uniform(0, height * 0.8)
+            x2 = rng.uniform(x1 + 1, width)
+            y2 = rng.uniform(y1 + 1, height)
+            bboxes.append([x1, y1, x2, y2])
+            labels.append(rng.choice(objects))
+        return str({task_token: {"bboxes": bboxes, "labels": labels}})
+    return str({task_token: ""})
+
+
+class MockFlorence:
+    # Request handler behind the Gradio endpoint. Latency is a draw from the
+    # base distribution plus a per-megapixel cost; failures are injected at
+    # random, independently of the image so retries can succeed.
+    def __init__(self, latency="lognormal:0.8,0.3", per_megapixel=0.0, error_rate=0.0,
+                 hang_rate=0.0, hang_seconds=60.0, seed=0):
+        self.latency = parse_latency(latency)
+        self.per_megapixel = per_megapixel
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.seed = seed
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+
+    def process_image(self, image, task_prompt, text_input=None, model_id=models[0]):
+        with self._lock:
+            self.requests += 1
+            delay = self.latency(self._rng)
+            fail = self._rng.random() < self.error_rate
+            hang = self._rng.random() < self.hang_rate
+
+        with Image.open(image) as img:
+            width, height = img.size
+        time.sleep(delay + self.per_megapixel * width * height / 1e6)
+        if hang:
+            time.sleep(self.hang_seconds)
+        if fail:
+            with self._lock:
+                self.failures += 1
+            raise gr.Error("Injected failure")
+
+        task_token = task_prompt if task_prompt.startswith("<") else task_tokens.get(task_prompt)
+        if task_token is None:
+            raise gr.Error(f"Unknown task prompt: {task_prompt}")
+        rng = random.Random(image_seed(image, (self.seed, task_token, model_id)))
+        return fake_result(task_token, rng, width, height), None
+
+
+def build_app(mock):
+    with gr.Blocks(title="Mock Florence-2") as demo:
+        gr.Markdown("Mock Florence-2: synthetic results for pipeline benchmarks")
+        with gr.Row():
+            # image_mode=None passes uploads through untouched; converting
+            # them makes Gradio re-save each one to a shared cache path that
+            # concurrent tasks on the same upload race on
+            image = gr.Image(type="filepath", image_mode=None, label="Input Image")
+            with gr.Column():
+                task_prompt = gr.Dropdown(list(task_tokens), value="Caption", label="Task Prompt")
+                text_input = gr.Textbox(label="Text Input (optional)")
+                model_id = gr.Dropdown(models, value=models[0], label="Model")
+                submit = gr.Button("Submit")
+        output_text = gr.Textbox(label="Output Text")
+        output_image = gr.Image(label="Output Image")
+        submit.click(
+            mock.process_image,
+            inputs=[image, task_prompt, text_input, model_id],
+            outputs=[output_text, output_image],
+            api_name="process_image",
+        )
+    return demo
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Mock Florence-2 Gradio server for GPU-free pipeline benchmarks."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7860)
+    parser.add_argument(
+        "--latency",
+        default="lognormal:0.8,0.3",
+        help="fixed:S, uniform:A,B, normal:MEAN,SD, lognormal:MEDIAN,SIGMA or exponential:MEAN (seconds)",
+    )
+    parser.add_argument(
+        "--per-megapixel", type=float, default=0.0, help="Extra seconds per image megapixel"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=1, help="Requests processed at once, like one GPU"
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument(
+        "--hang-rate", type=float, default=0.0, help="Fraction of requests that stall for --hang-seconds"
+    )
+    parser.add_argument("--hang-seconds", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0, help="Seed for results, latency and failures")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if gr is None:
+        raise SystemExit("The mock server needs Gradio: pip install gradio")
+
+    mock = MockFlorence(
+        args.latency, args.per_megapixel, args.error_rate, args.hang_rate, args.hang_seconds, args.seed
+    )
+    demo = build_app(mock)
+    demo.queue(default_concurrency_limit=args.concurrency)
+    demo.launch(server_name=args.host, server_port=args.port)
+
+
+if __name__ == "__main__":
+    main()
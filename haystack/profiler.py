@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from prettytable import PrettyTable
+from latency import summarize
+
+# Shared by every disabled span, so tracing costs one attribute check when off
+_disabled = nullcontext()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args = {**(self.args or {}), "error": exc_type.__name__}
+        self.tracer.add(self.name, self.start, end, self.args)
+        return False
+
+
+class Tracer:
+    # Records named spans (start and end in perf_counter seconds) per process
+    # and thread. Spans measured in other processes, such as render workers,
+    # are added with add(..., pid=, thread=). Exports a Chrome trace that
+    # chrome://tracing and https://ui.perfetto.dev open directly.
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        self._spans = []  # (name, start, end, pid, thread, args); list.append is thread-safe
+        self._threads = {}  # (pid, thread) -> name
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return _disabled
+        return _Span(self, name, args or None)
+
+    def add(self, name, start, end, args=None, pid=None, thread=None):
+        if not self.enabled:
+            return
+        if thread is None:
+            current = threading.current_thread()
+            thread = current.ident
+            self._threads.setdefault((self.pid, thread), current.name)
+        self._spans.append((name, start, end, pid or self.pid, thread, args))
+
+    def name_thread(self, pid, thread, name):
+        self._threads.setdefault((pid, thread), name)
+
+    def __len__(self):
+        return len(self._spans)
+
+    # Trace Event Format: one complete ("X") event per span, timestamps in
+    # microseconds since the tracer was created
+    def save(self, path):
+        thread_ids = {}
+        events = []
+        for (pid, thread), name in self._threads.items():
+            tid = thread_ids.setdefault((pid, thread), len(thread_ids) + 1)
+            events.append({"ph": "M", "name": "thread_name", "pid": pid, "tid": tid, "args": {"name": name}})
+        for pid in {pid for pid, _ in self._threads} | {self.pid}:
+            label = "start.py" if pid == self.pid else f"render worker {pid}"
+            events.append({"ph": "M", "name": "process_name", "pid": pid, "tid": 0, "args": {"name": label}})
+        for name, start, end, pid, thread, args in self._spans:
+            event = {
+                "ph": "X",
+                "name": name,
+                "cat": name.split(".")[0],
+                "pid": pid,
+                "tid": thread_ids.setdefault((pid, thread), len(thread_ids) + 1),
+                "ts": round((start - self.origin) * 1e6, 3),
+                "dur": round((end - start) * 1e6, 3),
+            }
+            if args:
+                event["args"] = args
+            events.append(event)
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        os.replace(tmp_path, path)
+
+    # Per-stage totals and latency percentiles, slowest total first. Stages
+    # run concurrently, so totals can add up to more than the wall time.
+    def summary(self):
+        durations = {}
+        for name, start, end, *_ in self._spans:
+            durations.setdefault(name, []).append(end - start)
+        wall = max((end for _, _, end, *_ in self._spans), default=self.origin) - self.origin
+
+        table = PrettyTable()
+        table.field_names = [
+            "Stage", "Count", "Total (s)", "% of wall", "Mean (ms)", "p50 (ms)", "p90 (ms)", "p99 (ms)", "Max (ms)"
+        ]
+        table.align = "r"
+        table.align["Stage"] = "l"
+        for name, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+            total = sum(values)
+            stats = summarize(values)
+            table.add_row(
+                [
+                    name,
+                    stats["count"],
+                    f"{total:.3f}",
+                    f"{total / wall * 100:.1f}%" if wall else "-",
+                    *(f"{stats[key] * 1000:.2f}" for key in ("mean", "p50", "p90", "p99", "max")),
+                ]
+            )
+        return f"Wall time: {wall:.3f}s\n{table}"
@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageDraw
+
+
+# Write WebP derivatives of a rendered image for the gallery: "full" at the
+# original resolution plus one per entry in sizes (name -> max width), each
+# scaled from the next larger one. Sizes the image already fits in are
+# skipped, since they would repeat the previous file. With full_path (a file
+# with the same pixels, e.g. the original), "full" points at it instead of
+# being encoded again. Returns {name: {"path", "width", "height", "bytes"}}.
+def save_derivatives(img, base_path, sizes, quality=80, full_path=None):
+    derivatives = {}
+    source = img
+    for name, max_width in [("full", None)] + sorted(sizes.items(), key=lambda s: -s[1]):
+        if max_width is not None:
+            if source.width <= max_width:
+                continue
+            height = max(1, round(source.height * max_width / source.width))
+            source = source.resize((max_width, height), Image.LANCZOS, reducing_gap=3.0)
+        elif full_path is not None:
+            derivatives[name] = {
+                "path": full_path,
+                "width": img.width,
+                "height": img.height,
+                "bytes": os.path.getsize(full_path),
+            }
+            continue
+        path = f"{base_path}_{name}.webp"
+        source.save(path, format="WEBP", quality=quality, method=4)
+        derivatives[name] = {
+            "path": path,
+            "width": source.width,
+            "height": source.height,
+            "bytes": os.path.getsize(path),
+        }
+    return derivatives
+
+
+# Draw bounding boxes and labels onto a copy of the image and save it as
+# gallery derivatives; the "full" WebP is the annotated image. Runs in a
+# worker process; returns the time spent (so the parent can report per-stage
+# throughput), the derivatives and the (stage, start, end, pid) timings of
+# each step for --profile.
+def draw_annotations(image_path, bboxes, labels, derivative_base, sizes, quality=80):
+    pid = os.getpid()
+    start_time = time.perf_counter()
+    img = Image.open(image_path).convert("RGB")
+    decoded = time.perf_counter()
+    draw = ImageDraw.Draw(img)
+    for bbox, label in zip(bboxes, labels):
+        x1, y1, x2, y2 = bbox
+        draw.rectangle([x1, y1, x2, y2], outline="red", width=3)
+        draw.text((x1, y1 - 10), label, fill="red")
+    drawn = time.perf_counter()
+    derivatives = save_derivatives(img, derivative_base, sizes, quality)
+    end_time = time.perf_counter()
+    timings = [
+        ("render.decode", start_time, decoded, pid),
+        ("render.draw", decoded, drawn, pid),
+        ("render.derivatives", drawn, end_time, pid),
+    ]
+    return end_time - start_time, derivatives, timings
+
+
+# Gallery derivatives of an image shown without annotations (no detections,
+# or overlay mode): the original file serves as "full", so only the smaller
+# sizes are encoded
+def make_derivatives(image_path, derivative_base, sizes, quality=80):
+    pid = os.getpid()
+    start_time = time.perf_counter()
+    with Image.open(image_path) as img:
+        img = img.convert("RGB")
+        decoded = time.perf_counter()
+        derivatives = save_derivatives(img, derivative_base, sizes, quality, full_path=image_path)
+    end_time = time.perf_counter()
+    timings = [
+        ("render.decode", start_time, decoded, pid),
+        ("render.derivatives", decoded, end_time, pid),
+    ]
+    return end_time - start_time, derivatives, timings
+
+
+class RenderStage:
+    # Annotation rendering decoupled from inference: jobs queue up for a
+    # process pool so PIL drawing and PNG encoding don't hold up the threads
+    # waiting on Florence. submit() blocks once max_queue jobs are pending.
+    # Jobs return (seconds spent, result, ...).
+    def __init__(self, workers=None, max_queue=16):
+        self.max_queue = max(1, max_queue)
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(self.max_queue)
+        self._lock = threading.Lock()
+        self._started = None
+        self.submitted = 0
+        self.completed = 0
+        self.depth = 0
+        self.peak_depth = 0
+        self._depth_total = 0
+        self.busy_seconds = 0.0
+
+    def submit(self, fn, *args):
+        self._slots.acquire()
+        with self._lock:
+            if self._started is None:
+                self._started = time.perf_counter()
+            self.submitted += 1
+            self.depth += 1
+            self.peak_depth = max(self.peak_depth, self.depth)
+            self._depth_total += self.depth
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self.depth -= 1
+            self.completed += 1
+            if not future.cancelled() and future.exception() is None:
+                self.busy_seconds += future.result()[0]
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.perf_counter() - self._started if self._started else 0.0
+            return {
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "queue_depth": self.depth,
+                "peak_queue_depth": self.peak_depth,
+                "mean_queue_depth": self._depth_total / self.submitted if self.submitted else 0.0,
+                "images_per_second": self.completed / elapsed if elapsed else 0.0,
+                "mean_render_seconds": self.busy_seconds / self.completed if self.completed else 0.0,
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown(wait=exc_type is None)
+        return False
@@ -0,0 +1,186 @@
+import json
+import os
+import time
+
+
+# Index an existing results log: the byte offset of the latest line for each
+# image plus the manifest entry stored with it. A partially written last line
+# (e.g. from a crash) is ignored and cut off so appends start on a clean line.
+def index_results_log(path):
+    index = {}
+    lines = 0
+    if not os.path.exists(path):
+        return index, lines
+
+    valid_end = 0
+    with open(path, "rb") as f:
+        offset = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            index[item["record"]["original_path"]] = (offset, item["entry"])
+            lines += 1
+            offset += len(line)
+            valid_end = offset
+
+    if valid_end != os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(valid_end)
+    return index, lines
+
+
+# Read back the line written at a given offset
+def read_logged(log_file, offset):
+    log_file.seek(offset)
+    return json.loads(log_file.readline())
+
+
+class ResultsLog:
+    # Append-only JSONL log of finished images. Each line holds the gallery
+    # record, the detected labels and the manifest entry of the source file.
+    # Lines are flushed immediately and fsynced every sync_every appends, so a
+    # crash loses at most one batch.
+    def __init__(self, path, sync_every=32, truncate=False):
+        self.path = path
+        self.sync_every = max(1, sync_every)
+        self._unsynced = 0
+        self._file = open(path, "wb" if truncate else "ab")
+
+    def append(self, record, labels, entry):
+        offset = self._file.tell()
+        line = json.dumps({"record": record, "labels": labels, "entry": entry})
+        self._file.write(line.encode("utf-8") + b"\n")
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every:
+            self.sync()
+        return offset
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+# Stream the logged records of image_paths (in that order) into the gallery
+# JSON without holding them all in memory. Yields each logged line so the
+# caller can aggregate labels. The output matches json.dump(..., indent=2).
+def write_image_data(output_path, log_path, offsets, image_paths):
+    tmp_path = f"{output_path}.tmp"
+    with open(log_path, "rb") as log_file, open(tmp_path, "w") as json_file:
+        json_file.write('{\n  "images": [')
+        for i, image_path in enumerate(image_paths):
+            item = read_logged(log_file, offsets[image_path])
+            record_json = json.dumps(item["record"], indent=2).replace("\n", "\n    ")
+            json_file.write(("," if i else "") + "\n    " + record_json)
+            yield item
+        json_file.write("\n  ]\n}" if image_paths else "]\n}")
+    os.replace(tmp_path, output_path)
+
+
+# Sharded alternative to write_image_data for large galleries: records go to
+# fixed-size shard files (image IDs start..start+shard_size-1 in each), with
+# the image ID and labels added so the viewer needs nothing else to render a
+# page. Shards beyond the new count are removed. Yields each logged line.
+def write_gallery_shards(directory, log_path, offsets, image_paths, shard_size):
+    os.makedirs(directory, exist_ok=True)
+    shard_count = (len(image_paths) + shard_size - 1) // shard_size
+    with open(log_path, "rb") as log_file:
+        for shard in range(shard_count):
+            start = shard * shard_size
+            path = os.path.join(directory, shard_file(shard))
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as out:
+                out.write(f'{{"start": {start}, "images": [')
+                for i, image_path in enumerate(image_paths[start:start + shard_size]):
+                    item = read_logged(log_file, offsets[image_path])
+                    record = {**item["record"], "id": start + i, "labels": item["labels"] or []}
+                    out.write(("," if i else "") + "\n" + json.dumps(record))
+                    yield item
+                out.write("\n]}\n")
+            os.replace(tmp_path, path)
+
+    for name in os.listdir(directory):
+        if name.startswith("shard-") and name.endswith(".json") and shard_index(name) >= shard_count:
+            os.unlink(os.path.join(directory, name))
+
+
+def shard_file(shard):
+    return f"shard-{shard:05d}.json"
+
+
+def shard_index(name):
+    try:
+        return int(name[len("shard-"):-len(".json")])
+    except ValueError:
+        return -1
+
+
+# Small manifest the viewer loads first: image count, label totals for the
+# treemap and the ID range, file and size of every shard. Written after the
+# shards; version changes on every run so browsers don't mix old and new
+# shards.
+def save_gallery_manifest(directory, image_count, shard_size, label_totals):
+    shards = []
+    for shard, start in enumerate(range(0, image_count, shard_size)):
+        path = shard_file(shard)
+        shards.append(
+            {
+                "path": path,
+                "start": start,
+                "count": min(shard_size, image_count - start),
+                "bytes": os.path.getsize(os.path.join(directory, path)),
+            }
+        )
+    manifest = {
+        "version": time.time_ns(),
+        "image_count": image_count,
+        "shard_size": shard_size,
+        "label_totals": label_totals,
+        "shards": shards,
+    }
+    path = os.path.join(directory, "manifest.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+# Per-label totals for the viewer's treemap, written in both gallery modes so
+# the viewer never has to download the per-image manifest
+def save_label_totals(path, image_count, label_totals):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"image_count": image_count, "label_totals": label_totals}, f)
+    os.replace(tmp_path, path)
+    return path
+
+
+# Rewrite the log so it holds exactly one line per live image, dropping lines
+# for deleted images and superseded results
+def compact_results_log(log_path, offsets, image_paths):
+    tmp_path = f"{log_path}.tmp"
+    with open(log_path, "rb") as log_file, open(tmp_path, "wb") as out:
+        for image_path in image_paths:
+            log_file.seek(offsets[image_path])
+            out.write(log_file.readline())
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, log_path)
@@ -0,0 +1,164 @@
+import math
+import threading
+import time
+import numpy as np
+import psutil
+
+try:
+    import pynvml  # Optional; GPU metrics are skipped without it or without a GPU
+except ImportError:
+    pynvml = None
+
+# Sampled metrics; GPU metrics stay NaN on machines without NVML
+cpu_metrics = ("cpu_percent", "memory_percent", "rss_mb", "net_sent_mbps", "net_recv_mbps")
+gpu_metrics = (
+    "gpu_percent", "gpu_memory_mb", "gpu_temp_c", "gpu_clock_mhz", "gpu_fan_percent", "gpu_power_w"
+)
+metrics = cpu_metrics + gpu_metrics
+
+
+class ResourceSampler:
+    # Samples CPU, memory, network and (when NVML and a GPU are present) GPU
+    # metrics on a background thread into a fixed-size ring buffer of
+    # numeric columns. window(start, end) gives the mean and max of every
+    # metric over an exact perf_counter() interval, e.g. one request.
+    def __init__(self, interval=0.1, capacity=100_000, gpu_index=0):
+        self.interval = interval
+        self.capacity = capacity
+        self._times = np.full(capacity, np.nan)
+        self._values = {name: np.full(capacity, np.nan) for name in metrics}
+        self._count = 0  # Samples written so far; the next goes to count % capacity
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._process = psutil.Process()
+        self._net = None
+        self.gpu = None
+        self.gpu_error = None
+
+        if pynvml is None:
+            self.gpu_error = "pynvml is not installed"
+        else:
+            try:
+                pynvml.nvmlInit()
+                self.gpu = pynvml.nvmlDeviceGetHandleByIndex(gpu_index)
+            except Exception as e:  # No NVIDIA driver or no GPU
+                self.gpu_error = repr(e)
+
+    # GPU name and driver for the system fingerprint; None without a GPU
+    def gpu_info(self):
+        if self.gpu is None:
+            return None
+        name = pynvml.nvmlDeviceGetName(self.gpu)
+        driver = pynvml.nvmlSystemGetDriverVersion()
+        return {
+            "name": name.decode() if isinstance(name, bytes) else name,
+            "driver": driver.decode() if isinstance(driver, bytes) else driver,
+        }
+
+    def _gpu_value(self, read):
+        try:
+            return float(read())
+        except Exception:  # Not supported on this GPU
+            return math.nan
+
+    def sample(self):
+        now = time.perf_counter()
+        net = psutil.net_io_counters()
+        values = {
+            "cpu_percent": psutil.cpu_percent(interval=None),
+            "memory_percent": psutil.virtual_memory().percent,
+            "rss_mb": self._process.memory_info().rss / (1024 ** 2),
+            "net_sent_mbps": math.nan,
+            "net_recv_mbps": math.nan,
+        }
+        if self._net is not None:
+            last_time, last_net = self._net
+            elapsed = now - last_time
+            if elapsed > 0:
+                values["net_sent_mbps"] = (net.bytes_sent - last_net.bytes_sent) / elapsed / (1024 ** 2)
+                values["net_recv_mbps"] = (net.bytes_recv - last_net.bytes_recv) / elapsed / (1024 ** 2)
+        self._net = (now, net)
+
+        if self.gpu is not None:
+            handle = self.gpu
+            values["gpu_percent"] = self._gpu_value(lambda: pynvml.nvmlDeviceGetUtilizationRates(handle).gpu)
+            values["gpu_memory_mb"] = self._gpu_value(
+                lambda: pynvml.nvmlDeviceGetMemoryInfo(handle).used / (1024 ** 2)
+            )
+            values["gpu_temp_c"] = self._gpu_value(
+                lambda: pynvml.nvmlDeviceGetTemperature(handle, pynvml.NVML_TEMPERATURE_GPU)
+            )
+            values["gpu_clock_mhz"] = self._gpu_value(
+                lambda: pynvml.nvmlDeviceGetClockInfo(handle, pynvml.NVML_CLOCK_GRAPHICS)
+            )
+            values["gpu_fan_percent"] = self._gpu_value(lambda: pynvml.nvmlDeviceGetFanSpeed(handle))
+            values["gpu_power_w"] = self._gpu_value(lambda: pynvml.nvmlDeviceGetPowerUsage(handle) / 1000)
+
+        with self._lock:
+            slot = self._count % self.capacity
+            self._times[slot] = now
+            for name in metrics:
+                self._values[name][slot] = values.get(name, math.nan)
+            self._count += 1
+        return values
+
+    def start(self):
+        psutil.cpu_percent(interval=None)  # Prime the CPU counter
+
+        def loop():
+            while not self._stop.is_set():
+                started = time.perf_counter()
+                self.sample()
+                self._stop.wait(max(0.0, self.interval - (time.perf_counter() - started)))
+
+        self._thread = threading.Thread(target=loop, name="resource-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    # Most recent sample, or None before the first one
+    def latest(self):
+        with self._lock:
+            if not self._count:
+                return None
+            slot = (self._count - 1) % self.capacity
+            return {name: float(self._values[name][slot]) for name in metrics}
+
+    # Mean and max of every metric over [start, end] (perf_counter seconds).
+    # Requests shorter than the interval use the sample closest to their end.
+    def window(self, start, end):
+        with self._lock:
+            times = self._times
+            mask = (times >= start) & (times <= end)
+            if not mask.any():
+                before = np.where(times <= end, times, -np.inf)
+                mask = np.zeros(len(times), dtype=bool)
+                if np.isfinite(before).any():
+                    mask[np.argmax(before)] = True
+            selected = {name: column[mask] for name, column in self._values.items()}
+
+        stats = {"samples": int(mask.sum())}
+        for name in metrics:
+            values = selected[name][~np.isnan(selected[name])]
+            stats[f"{name}_mean"] = float(values.mean()) if len(values) else math.nan
+            stats[f"{name}_max"] = float(values.max()) if len(values) else math.nan
+        return stats
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        if self.gpu is not None:
+            try:
+                pynvml.nvmlShutdown()
+            except Exception:
+                pass
+            self.gpu = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
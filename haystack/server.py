@@ -1,30 +1,327 @@
 import http.server
-import socketserver
 import threading
 import webbrowser
 import logging
 import time
+import os
+import io
+import gzip
+import json
+import re
+import email.utils
+import urllib.parse
+from collections import OrderedDict
+from catalog import Catalog
+from gallery_index import GalleryIndex, StaleIndexError
+
+try:
+    import brotli  # Optional; gzip is used when it isn't installed
+except ImportError:
+    brotli = None
 
 PORT = 8000
 DIRECTORY = "."
 
+# Text responses (HTML, JSON, JS, CSS, SVG) are compressed when the client
+# accepts it; images are already compressed and go out via sendfile.
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+MIN_COMPRESS_SIZE = 1024
+MAX_COMPRESS_SIZE = 16 * 1024 * 1024  # Larger files go out uncompressed via sendfile
+COMPRESSED_CACHE_BYTES = 64 * 1024 * 1024
+
+# The only Range form served; any other Range header is ignored
+single_range = re.compile(r"^\s*bytes\s*=\s*(?:(\d+)-(\d*)|-(\d+))\s*$")
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 
+# Compressed bodies keyed by (path, encoding), reused until the file changes
+compressed_cache = OrderedDict()
+compressed_cache_bytes = 0
+compressed_cache_lock = threading.Lock()
+
+
+def compress_file(path, stat, encoding):
+    global compressed_cache_bytes
+    key = (path, encoding)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with compressed_cache_lock:
+        cached = compressed_cache.get(key)
+        if cached is not None and cached[0] == version:
+            compressed_cache.move_to_end(key)
+            return cached[1]
+
+    with open(path, "rb") as f:
+        data = f.read()
+    if encoding == "br":
+        body = brotli.compress(data)
+    else:
+        body = gzip.compress(data, compresslevel=6)
+
+    with compressed_cache_lock:
+        previous = compressed_cache.pop(key, None)
+        if previous is not None:
+            compressed_cache_bytes -= len(previous[1])
+        compressed_cache[key] = (version, body)
+        compressed_cache_bytes += len(body)
+        while compressed_cache_bytes > COMPRESSED_CACHE_BYTES and len(compressed_cache) > 1:
+            _, (_, evicted) = compressed_cache.popitem(last=False)
+            compressed_cache_bytes -= len(evicted)
+    return body
+
+
 class Handler(http.server.SimpleHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests
+    protocol_version = "HTTP/1.1"
+
+    # Query index over start.py's output, loaded once when the server starts
+    gallery_index = None
+    catalog = None  # Caption search, when start.py was run with --catalog
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, directory=DIRECTORY, **kwargs)
 
     def do_GET(self):
         logging.info(f"GET request for {self.path}")
-        super().do_GET()
+        route = urllib.parse.urlsplit(self.path).path
+        if route == "/api/images":
+            self.handle_images_api()
+            return
+        if route == "/api/search":
+            self.handle_search_api()
+            return
+        body = self.send_head()
+        if body is not None:
+            self.send_body(body)
+
+    # GET /api/images?page=1&limit=24&label=person AND NOT car&sort=name&order=desc
+    #     &fields=original_path,annotated_path
+    def handle_images_api(self):
+        params = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+
+        def param(name, default=None):
+            return params.get(name, [default])[0]
+
+        index = self.gallery_index
+        if index is None or not index.available():
+            self.send_json({"error": "No gallery data; run start.py first."}, 404)
+            return
+        try:
+            fields = param("fields")
+            result = index.query(
+                page=int(param("page", 1)),
+                limit=int(param("limit", 24)),
+                label=param("label"),
+                sort=param("sort", "id"),
+                order=param("order", "asc"),
+                fields=fields.split(",") if fields else None,
+            )
+        except ValueError as e:
+            self.send_json({"error": str(e)}, 400)
+            return
+        except StaleIndexError as e:
+            self.send_json({"error": str(e)}, 503)
+            return
+        self.send_json(result)
+
+    # GET /api/search?q=man with helmet near bicycle&page=1&limit=24
+    def handle_search_api(self):
+        params = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+
+        def param(name, default=None):
+            return params.get(name, [default])[0]
+
+        catalog = self.catalog
+        if catalog is None or not catalog.available():
+            self.send_json({"error": "No catalog; run start.py --catalog first."}, 404)
+            return
+        try:
+            result = catalog.search(
+                param("q", ""), page=int(param("page", 1)), limit=int(param("limit", 24))
+            )
+        except ValueError as e:
+            self.send_json({"error": str(e)}, 400)
+            return
+        self.send_json(result)
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        encoding = self.choose_encoding("application/json", len(body))
+        if encoding == "br":
+            body = brotli.compress(body)
+        elif encoding == "gzip":
+            body = gzip.compress(body, compresslevel=6)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Vary", "Accept-Encoding")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        body = self.send_head()
+        if isinstance(body, tuple):
+            body[0].close()
+        elif body is not None:
+            body.close()
 
     def do_POST(self):
         logging.info(f"POST request for {self.path}")
         super().do_POST()
 
+    # Files are served with validators (ETag, Last-Modified), conditional
+    # 304 responses, byte ranges and optional compression. Returns a file-like
+    # body, a (file, offset, length) tuple for sendfile, or None.
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return super().send_head()  # Directories, redirects and 404s
+
+        stat = os.stat(path)
+        ctype = self.guess_type(path)
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        last_modified = self.date_time_string(int(stat.st_mtime))
+
+        if self.not_modified(etag, stat.st_mtime):
+            self.send_response(304)
+            self.send_validators(etag, last_modified)
+            self.end_headers()
+            return None
+
+        range_header = self.headers.get("Range")
+        if range_header and not single_range.match(range_header):
+            range_header = None  # Multi-range and other units may be ignored (RFC 9110): send it all
+        encoding = None if range_header else self.choose_encoding(ctype, stat.st_size)
+        if encoding:
+            body = compress_file(path, stat, encoding)
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Vary", "Accept-Encoding")
+            self.send_validators(f'{etag[:-1]}-{encoding}"', last_modified)
+            self.end_headers()
+            return io.BytesIO(body)
+
+        offset, length = 0, stat.st_size
+        if range_header:
+            byte_range = self.parse_range(range_header, stat.st_size)
+            if byte_range is None:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{stat.st_size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+            offset, length = byte_range
+
+        f = open(path, "rb")
+        if range_header:
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {offset}-{offset + length - 1}/{stat.st_size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        if ctype.startswith(COMPRESSIBLE_TYPES):
+            self.send_header("Vary", "Accept-Encoding")
+        self.send_validators(etag, last_modified)
+        self.end_headers()
+        return f, offset, length
+
+    def send_validators(self, etag, last_modified):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.send_header("Cache-Control", "no-cache")  # Always revalidate, usually a 304
+
+    def not_modified(self, etag, mtime):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match:
+            tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+            base = etag[:-1]
+            return "*" in tags or any(t == etag or t.startswith(base + "-") for t in tags)
+
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            return since is not None and int(mtime) <= since.timestamp()
+        return False
+
+    def choose_encoding(self, ctype, size):
+        if not MIN_COMPRESS_SIZE <= size <= MAX_COMPRESS_SIZE or not ctype.startswith(COMPRESSIBLE_TYPES):
+            return None
+        accepted = {}
+        for part in self.headers.get("Accept-Encoding", "").split(","):
+            name, _, params = part.strip().partition(";")
+            quality = 1.0
+            if params.strip().startswith("q="):
+                try:
+                    quality = float(params.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[name.strip().lower()] = quality
+        if brotli is not None and accepted.get("br", 0) > 0:
+            return "br"
+        if accepted.get("gzip", 0) > 0:
+            return "gzip"
+        return None
+
+    # Single byte range ("bytes=start-end", "bytes=start-" or "bytes=-suffix")
+    # as matched by single_range. Returns (offset, length), or None when it
+    # can't be satisfied.
+    @staticmethod
+    def parse_range(range_header, size):
+        start, end, suffix = single_range.match(range_header).groups()
+        if start:
+            first = int(start)
+            last = int(end) if end else size - 1
+        else:
+            first = max(0, size - int(suffix))
+            last = size - 1
+        last = min(last, size - 1)
+        if first > last or first >= size:
+            return None
+        return first, last - first + 1
+
+    # Zero-copy for files: socket.sendfile uses os.sendfile where available
+    def send_body(self, body):
+        if isinstance(body, tuple):
+            f, offset, length = body
+            try:
+                self.connection.sendfile(f, offset, length)
+            finally:
+                f.close()
+        else:
+            try:
+                self.copyfile(body, self.wfile)
+            finally:
+                body.close()
+
+
+class ThreadingServer(http.server.ThreadingHTTPServer):
+    # Each connection gets its own thread, so a slow client can't stall others
+    daemon_threads = True
+
 
 def run_server(open_browser=True, timeout=300):  # Timeout in seconds
-    with socketserver.TCPServer(("", PORT), Handler) as httpd:
+    # Load the gallery query index up front so the first page is fast
+    index = GalleryIndex(
+        os.path.join(DIRECTORY, "image_results.jsonl"),
+        os.path.join(DIRECTORY, "image_manifest.json"),
+        os.path.join(DIRECTORY, "label_index.json"),
+    )
+    if index.available():
+        index.refresh()
+        print(f"Loaded gallery index with {len(index)} images")
+    Handler.gallery_index = index
+    Handler.catalog = Catalog(os.path.join(DIRECTORY, "catalog.sqlite"))
+
+    with ThreadingServer(("", PORT), Handler) as httpd:
         print(f"Serving at http://localhost:{PORT} (Press Ctrl+C to terminate the server)")
         if open_browser:
             try:
@@ -53,4 +350,4 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         print("Shutting down the server with Control-C...")
     finally:
-        print("Cleanup complete.")
\ No newline at end of file
+        print("Cleanup complete.")
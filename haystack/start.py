@@ -1,50 +1,162 @@
 import os
+import ast
 import json
-from gradio_client import Client, handle_file
-from PIL import Image, ImageDraw
+import time
+import shutil
+import argparse
+import tempfile
 from datetime import datetime
 from alive_progress import alive_bar
 import subprocess
+from collections import deque
+from concurrent.futures import Future
+from contextlib import nullcontext
+from backends import BackendPool, endpoints_from_env, predict_with_timeout
+from catalog import CatalogWriter
+from dedup import DuplicateIndex, image_fingerprint
+from dispatcher import InferenceDispatcher
+from render import RenderStage, draw_annotations, make_derivatives
+from upload import ImageUpload, rescale_result
+from result_cache import ResultCache
+from detections import DetectionStore
+from facets import LabelIndex
+from manifest import load_manifest, save_manifest, scan_images
+from profiler import Tracer
+from results_log import (
+    ResultsLog,
+    compact_results_log,
+    index_results_log,
+    read_logged,
+    save_gallery_manifest,
+    save_label_totals,
+    write_gallery_shards,
+    write_image_data,
+)
 
-# Initialize Gradio client
-client = Client("http://127.0.0.1:7860/")
+# Florence servers; requests are balanced across all of them. Override with
+# --endpoint or FLORENCE_ENDPOINTS. Clients are created in main() so that
+# render worker processes importing this module don't open connections.
+florence_endpoints = ["http://127.0.0.1:7860/"]
 
 # Directory setup
 image_dir = "./images/"
 annotated_dir = "./annotated/"
 output_json = "image_data.json"
+gallery_dir = "gallery"  # Sharded gallery data plus manifest.json (--shards)
+shard_size = 1000  # Images per shard
 output_html = "viewer.html"
+manifest_json = "image_manifest.json"  # mtimes, sizes, hashes and labels from the last run
+results_log = "image_results.jsonl"  # Finished images, appended as they complete
+label_index_json = "label_index.json"  # Per-label bitmaps of image IDs for filtering
+label_totals_json = "label_totals.json"  # Per-label image counts for the treemap
+detections_dir = "detections"  # Columnar store of every detected box (NumPy arrays)
+catalog_db = "catalog.sqlite"  # Optional SQLite catalog with caption search (--catalog)
+profile_trace_json = "profile_trace.json"  # Chrome trace of every pipeline stage (--profile)
+log_sync_every = 32  # fsync the results log after this many images
 florence_model = "microsoft/Florence-2-base-ft"
 
-# Ensure directories exist
-if not os.path.exists(image_dir):
-    raise FileNotFoundError(f"The directory {image_dir} does not exist.")
+# Concurrency settings for Florence requests, per endpoint
+max_workers = 4  # Worker threads talking to each Florence server
+max_in_flight = 8  # Upper bound on submitted but unfinished requests
+min_in_flight = 1  # Lower bound when the limit adapts to latency (see --fixed-concurrency)
+health_check_interval = 10  # Seconds between endpoint health checks
+request_retries = 2  # Extra rounds over the endpoints for a failed request
+retry_backoff = 1.0  # Seconds before the first retry, doubled for each next one
+request_timeout = 120.0  # Seconds before a Florence request is abandoned and retried
+max_pending_images = 64  # Images submitted but not yet finished before submission waits
 
-if not os.path.exists(annotated_dir):
-    os.makedirs(annotated_dir)
+# Annotation rendering runs in its own process pool, fed by a bounded queue
+render_workers = max(1, (os.cpu_count() or 2) - 1)
+render_queue_size = 16
 
-# Clear the annotated directory
-for file in os.listdir(annotated_dir):
-    file_path = os.path.join(annotated_dir, file)
-    if os.path.isfile(file_path):
-        os.unlink(file_path)
+# WebP derivatives for the gallery: max width of each size, plus "full" at
+# the original resolution. Cards pick one through srcset; sizes wider than
+# the image are skipped.
+thumbnail_sizes = {"small": 400, "medium": 1024}
+thumbnail_quality = 80
 
-# Supported image formats
-supported_formats = (".jpg", ".jpeg", ".png", ".webp")
+# Result cache settings; raw Florence responses are reused across runs
+use_cache = True
+cache_path = "./.cache/results.sqlite"
+cache_max_bytes = 256 * 1024 * 1024  # Least recently used entries are evicted past this
 
-# Scan for images in the directory
-images = [
-    os.path.join(image_dir, f)
-    for f in os.listdir(image_dir)
-    if f.lower().endswith(supported_formats)
-]
+# Optional downscale before upload; returned bboxes are mapped back to the
+# original pixel coordinates. 0 sends the original files unchanged.
+upload_max_side = 0
+upload_format = "JPEG"  # "JPEG" or "WEBP"
+upload_quality = 90
 
-if not images:
-    raise FileNotFoundError(f"No images found in the directory {image_dir}.")
+# Upload each image once and run every task prompt against the remote copy
+upload_once = True
+
+# Near-duplicate reuse (--dedup): images within this many bits (of 64) of an
+# earlier image in both pHash and dHash, with the same aspect ratio, reuse
+# its results instead of calling Florence
+dedup_distance = 6
+dedup_max_aspect_change = 0.02
+
+# Supported image formats
+supported_formats = (".jpg", ".jpeg", ".png", ".webp")
 
 # Define task prompts
 task_prompts = ["Caption", "Detailed Caption", "Object Detection"]
 
+# Stage timings for --profile; spans are no-ops until main() enables it
+tracer = Tracer()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Process images with Florence-2 and build the gallery."
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only process images added or changed since the last run and drop deleted ones",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run, skipping images already in the results log",
+    )
+    parser.add_argument(
+        "--endpoint",
+        action="append",
+        metavar="URL",
+        help="Florence server URL; repeat to balance across several servers",
+    )
+    parser.add_argument(
+        "--overlay",
+        action="store_true",
+        help="Store bounding boxes for the viewer to draw instead of rendering annotated PNGs",
+    )
+    parser.add_argument(
+        "--catalog",
+        action="store_true",
+        help=f"Also build {catalog_db}, a SQLite catalog with full-text search over captions",
+    )
+    parser.add_argument(
+        "--fixed-concurrency",
+        action="store_true",
+        help="Always keep max_in_flight requests in flight instead of adapting the limit to Florence latency",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Reuse the results of near-identical images (perceptual hashes) instead of calling Florence",
+    )
+    parser.add_argument(
+        "--shards",
+        action="store_true",
+        help=f"Write the gallery as {shard_size}-image shards in {gallery_dir}/ instead of one {output_json}",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=f"Time every stage of every image and task; writes {profile_trace_json} and prints a summary",
+    )
+    return parser.parse_args()
+
 
 def clean_keys(d):
     if isinstance(d, dict):
@@ -62,114 +174,606 @@ def clean_keys(d):
         return d
 
 
-# Process each image
-image_results = []
-label_counts = {}
-image_labels_map = {}
+# Florence returns results as Python reprs; literal_eval keeps apostrophes in
+# captions intact. Returns the text unchanged when it isn't a literal.
+def parse_result(result_text):
+    try:
+        return ast.literal_eval(result_text)
+    except (ValueError, SyntaxError):
+        return result_text
+
+
+# Object Detection boxes of a record in either mode
+def record_bboxes(record):
+    if "detections" in record:
+        return record["detections"]["bboxes"]
+    detection = record["combined_json"].get("Object Detection", {}).get("Object Detection")
+    return detection.get("bboxes", []) if isinstance(detection, dict) else []
+
+
+def reformat_result(result_dict):
+    for key in list(result_dict.keys()):
+        value = result_dict[key]
+        # Check if value is a nested dictionary with an empty string as key
+        if isinstance(value, dict) and "" in value:
+            result_dict[key] = value[""]
+
+    # Convert to JSON with proper formatting
+    return json.dumps(result_dict, indent=4)
+
+
+# Cache key parts for a task; downscaled uploads are cached separately
+def cache_key(image_hash, task_prompt):
+    key = (image_hash, florence_model, task_prompt)
+    if upload_max_side:
+        key += (f"{upload_format}@{upload_max_side}",)
+    return key
+
+
+# Run a single (image, task) job against Florence; called from worker threads.
+# Tasks of one image share an affinity key so they reuse the same upload.
+# Every predict() attempt is reported to the dispatcher, whose adaptive
+# limit should follow Florence latency rather than upload time. An attempt
+# that runs past request_timeout raises TimeoutError, so it is reported as
+# a failure and the pool retries it.
+def run_task(dispatcher, pool, cache, upload, image_hash, task_prompt):
+    image_name = os.path.basename(upload.image_path)
+    print(f"  Task Prompt: {task_prompt} ({image_name})")
+
+    def predict(client):
+        with tracer.span("upload", image=image_name, task=task_prompt):
+            image_file, scale = upload.file_for(client)
+        started = time.perf_counter()
+        failed = True
+        try:
+            with tracer.span("predict", image=image_name, task=task_prompt, endpoint=client.src):
+                result = predict_with_timeout(
+                    client,
+                    request_timeout,
+                    image=image_file,
+                    task_prompt=task_prompt,
+                    text_input=None,
+                    model_id=florence_model,
+                    api_name="/process_image",
+                )
+            failed = False
+        finally:
+            dispatcher.observe(started, time.perf_counter(), failed)
+        return result[0], scale
+
+    result_text, scale = pool.run(predict, key=upload.image_path)
+    with tracer.span("rescale", image=image_name, task=task_prompt):
+        result_text = rescale_result(result_text, scale)
+    if cache is not None:
+        with tracer.span("cache.put", image=image_name, task=task_prompt):
+            cache.put(result_text, *cache_key(image_hash, task_prompt))
+    return result_text
+
+
+# Serve a task from the cache when possible, otherwise send it to Florence
+def submit_task(dispatcher, pool, cache, upload, image_hash, task_prompt):
+    if cache is not None:
+        with tracer.span("cache.get", task=task_prompt):
+            cached = cache.get(*cache_key(image_hash, task_prompt))
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return future
+    return dispatcher.submit(run_task, dispatcher, pool, cache, upload, image_hash, task_prompt)
+
+
+# Future resolving to a result with its boxes scaled by (x, y)
+def rescaled_future(future, scale):
+    if scale == (1.0, 1.0):
+        return future
+    rescaled = Future()
+
+    def copy(done):
+        try:
+            rescaled.set_result(rescale_result(done.result(), scale))
+        except Exception as e:
+            rescaled.set_exception(e)
 
-# Process images with a single progress bar
-total_steps = len(images) * len(task_prompts)
-with alive_bar(total_steps, title="Processing Images") as bar:
-    for image_path in images:
-        print(f"Processing: {image_path}")
+    future.add_done_callback(copy)
+    return rescaled
 
-        # Initialize result dictionary for this image
-        result_dict = {}
 
-        # Loop through selected task prompts
+# Task results of a near-duplicate from the dedup index: the futures of an
+# image still in flight, or the cached results of one that finished (in this
+# run or an earlier one). Returns (task futures, duplicate info), or
+# (None, None) to process the image normally.
+def duplicate_tasks(dedup, fingerprint, in_flight, cache):
+    match = dedup.find(fingerprint)
+    if match is None:
+        return None, None
+    canonical, distance = match
+    canonical_fingerprint, canonical_hash = dedup.images[canonical]
+    futures = in_flight.get(canonical)
+    if futures is None:
+        if cache is None:
+            return None, None
+        futures = {}
         for task_prompt in task_prompts:
-            print(f"  Task Prompt: {task_prompt}")
-            result = client.predict(
-                image=handle_file(image_path),
-                task_prompt=task_prompt,
-                text_input=None,
-                model_id=florence_model,
-                api_name="/process_image",
+            cached = cache.get(*cache_key(canonical_hash, task_prompt))
+            if cached is None:
+                return None, None
+            futures[task_prompt] = Future()
+            futures[task_prompt].set_result(cached)
+    scale = (
+        fingerprint["width"] / canonical_fingerprint["width"],
+        fingerprint["height"] / canonical_fingerprint["height"],
+    )
+    task_futures = {task_prompt: rescaled_future(f, scale) for task_prompt, f in futures.items()}
+    return task_futures, {"duplicate_of": canonical, "duplicate_distance": distance}
+
+
+# Collect the task results for one image, queue its annotation and gallery
+# derivatives for rendering and build its record. Returns the record, the
+# detected labels (None without Object Detection) and the render future.
+# With overlay, the boxes are stored in the record instead of being drawn.
+def finish_image(image_path, upload, task_futures, renderer, bar, overlay=False):
+    image_name = os.path.basename(image_path)
+    result_dict = {}
+    for task_prompt, future in task_futures.items():
+        with tracer.span("inference.wait", image=image_name, task=task_prompt):
+            result_dict[task_prompt] = future.result()
+        bar.text = f"Processing {os.path.basename(image_path)}: {task_prompt}"
+        bar()
+    upload.cleanup()
+    if upload.bytes_uploaded:
+        print(f"  Uploaded {upload.bytes_uploaded / 1024:.1f} KB for {os.path.basename(image_path)}")
+
+    # Draw bounding boxes for Object Detection (if applicable) in the render stage
+    labels = None
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    stem = f"{os.path.basename(image_path).split('.')[0]}_{timestamp}"
+    if "Object Detection" in result_dict:
+        with tracer.span("parse", image=image_name, task="Object Detection"):
+            detection_data = parse_result(result_dict["Object Detection"])
+        bboxes = detection_data["<OD>"]["bboxes"]
+        labels = detection_data["<OD>"]["labels"]
+
+    if labels is not None and not overlay:
+        # Save the annotated image with a unique filename; its full-size WebP
+        # is the annotated copy
+        annotated_path = os.path.join(annotated_dir, f"annotated_{stem}_full.webp")
+        job = (
+            draw_annotations,
+            image_path,
+            bboxes,
+            labels,
+            os.path.join(annotated_dir, f"annotated_{stem}"),
+            thumbnail_sizes,
+            thumbnail_quality,
+        )
+    else:
+        # Use the original image if no detection is performed, or in overlay
+        # mode, where the viewer draws the boxes itself
+        annotated_path = image_path
+        job = (
+            make_derivatives,
+            image_path,
+            os.path.join(annotated_dir, f"thumb_{stem}"),
+            thumbnail_sizes,
+            thumbnail_quality,
+        )
+    with tracer.span("render.submit", image=image_name):  # Blocks while the render queue is full
+        rendered = renderer.submit(*job)
+
+    # Clean up and format JSON output
+    with tracer.span("parse", image=image_name, task="all"):
+        cleaned_result_dict = {key: parse_result(value) for key, value in result_dict.items()}
+        combined_json = clean_keys(cleaned_result_dict)  # Clean keys for readability
+
+    # Use "Caption" as the title for the modal
+    modal_title = cleaned_result_dict.get("Caption", {}).get("", "Image")
+
+    record = {
+        "original_path": image_path,
+        "annotated_path": annotated_path,
+        "combined_json": combined_json,
+        "modal_title": modal_title,
+    }
+    if overlay and labels is not None:
+        record["detections"] = {"bboxes": bboxes, "labels": labels}
+    return record, labels, rendered
+
+
+# Pipeline: (image, task) jobs go through a bounded worker pool, finished
+# images are handed to the render stage, and (image_path, record, labels) is
+# yielded once an image's annotation and derivatives are on disk. Both
+# hand-offs happen in submission order, so a logged result always has its
+# files. An image whose requests still fail after the pool's retries is
+# yielded with a None record and left out of the gallery. With a dedup
+# index, near-duplicates of earlier images reuse their results and every
+# other image is added to the index. With adaptive, the
+# in-flight limit follows Florence latency; every slot gets its own worker
+# so a higher limit really puts more requests on the server. At most
+# max_pending_images images wait on Florence at once, so a slow image at
+# the head of the queue holds back submission instead of letting uploads
+# and results pile up behind it.
+def process_images(image_paths, hashes, pool, cache, overlay=False, dedup=None, adaptive=True):
+    total_steps = len(image_paths) * len(task_prompts)
+    start_time = time.perf_counter()
+    inferred = 0
+    bytes_uploaded = 0
+    original_bytes = 0  # Size of the original images
+    thumbnail_bytes = {}
+    duplicates = 0
+    failed = 0  # Images given up on after retries
+    endpoints = len(pool.backends)
+    with alive_bar(total_steps, title="Processing Images") as bar, InferenceDispatcher(
+        max_workers=(max_in_flight if adaptive else max_workers) * endpoints,
+        max_in_flight=max_in_flight * endpoints,
+        adaptive=adaptive,
+        min_in_flight=min_in_flight,
+    ) as dispatcher, RenderStage(
+        render_workers, render_queue_size
+    ) as renderer, tempfile.TemporaryDirectory(prefix="haystack-upload-") as upload_dir:
+        pending = deque()  # Waiting on Florence
+        rendering = deque()  # Waiting on the render stage
+        in_flight = {}  # Task futures of pending images, for duplicates to share
+
+        def finish_next():
+            nonlocal inferred, bytes_uploaded, failed
+            image_path, upload, task_futures, duplicate = pending.popleft()
+            in_flight.pop(image_path, None)
+            try:
+                record, labels, rendered = finish_image(
+                    image_path, upload, task_futures, renderer, bar, overlay
+                )
+            except Exception as e:
+                print(f"  Failed: {image_path}: {e!r}")
+                upload.cleanup()
+                pool.forget(image_path)
+                skipped = Future()
+                skipped.set_result(None)
+                rendering.append((image_path, None, None, skipped))
+                failed += 1
+                return
+            if duplicate:
+                record.update(duplicate)
+            rendering.append((image_path, record, labels, rendered))
+            inferred += 1
+            bytes_uploaded += upload.bytes_uploaded
+            pool.forget(image_path)
+
+        def pop_rendered():
+            nonlocal original_bytes
+            image_path, record, labels, rendered = rendering.popleft()
+            if record is None:
+                return image_path, None, None
+            with tracer.span("render.wait", image=os.path.basename(image_path)):
+                _, derivatives, timings = rendered.result()  # Surfaces rendering errors
+            for stage, start, end, pid in timings:
+                tracer.name_thread(pid, pid, "render")
+                tracer.add(stage, start, end, {"image": os.path.basename(image_path)}, pid=pid, thread=pid)
+            record["thumbnails"] = {
+                name: {"path": d["path"], "width": d["width"]} for name, d in derivatives.items()
+            }
+            record["width"] = derivatives["full"]["width"]
+            record["height"] = derivatives["full"]["height"]
+            original_bytes += os.path.getsize(image_path)
+            for name, d in derivatives.items():
+                thumbnail_bytes[name] = thumbnail_bytes.get(name, 0) + d["bytes"]
+            return image_path, record, labels
+
+        for image_path in image_paths:
+            while len(pending) >= max_pending_images:
+                finish_next()
+            print(f"Processing: {image_path}")
+            upload = ImageUpload(
+                image_path, upload_max_side, upload_format, upload_quality, upload_dir, upload_once
+            )
+            task_futures = duplicate = None
+            if dedup is not None:
+                with tracer.span("dedup", image=os.path.basename(image_path)):
+                    fingerprint = image_fingerprint(image_path)
+                    task_futures, duplicate = duplicate_tasks(dedup, fingerprint, in_flight, cache)
+                if duplicate:
+                    duplicates += 1
+                    print(f"  Near-duplicate of {duplicate['duplicate_of']} ({duplicate['duplicate_distance']} bits)")
+                else:
+                    dedup.add(image_path, fingerprint, hashes[image_path])
+            if task_futures is None:
+                task_futures = {
+                    task_prompt: submit_task(
+                        dispatcher, pool, cache, upload, hashes[image_path], task_prompt
+                    )
+                    for task_prompt in task_prompts
+                }
+                in_flight[image_path] = task_futures
+            pending.append((image_path, upload, task_futures, duplicate))
+
+            # Finish any leading images whose tasks are all done
+            while pending and all(f.done() for f in pending[0][2].values()):
+                finish_next()
+            while rendering and rendering[0][3].done():
+                yield pop_rendered()
+
+        while pending:
+            finish_next()
+        inference_seconds = time.perf_counter() - start_time
+        while rendering:
+            yield pop_rendered()
+
+        stats = dispatcher.stats()
+        print(
+            f"Dispatcher: {stats['completed']} requests, {stats['workers']} workers, "
+            f"peak {stats['peak_in_flight']}/{stats['max_in_flight']} in flight, "
+            f"{stats['throughput']:.2f} requests/s, {stats['mean_latency']:.3f}s mean predict latency"
+        )
+        if adaptive:
+            print(
+                f"Adaptive limit: {stats['limit']} in flight (ranged {stats['lowest_limit']}-"
+                f"{stats['highest_limit']} of {stats['min_in_flight']}-{stats['max_in_flight']}, "
+                f"{stats['limit_decreases']} decreases, {stats['baseline_latency'] or 0:.3f}s baseline latency)"
+            )
+        render_stats = renderer.stats()
+        inference_rate = inferred / inference_seconds if inference_seconds else 0.0
+        print(f"Inference stage: {inferred} images, {inference_rate:.2f} images/s")
+        if failed:
+            print(f"Failed: {failed} images, left out of the gallery")
+        if dedup is not None:
+            print(
+                f"Dedup: {duplicates} near-duplicates reused earlier results "
+                f"({duplicates * len(task_prompts)} Florence requests skipped)"
             )
-            result_dict[task_prompt] = result[0]
-            bar.text = f"Processing {os.path.basename(image_path)}: {task_prompt}"
-            bar()
-
-        # Open the image and draw bounding boxes for Object Detection (if applicable)
-        if "Object Detection" in result_dict:
-            detection_data = json.loads(
-                result_dict["Object Detection"].replace("'", '"')
+        print(
+            f"Uploaded {bytes_uploaded / (1024 ** 2):.2f} MB "
+            f"({bytes_uploaded / 1024 / max(inferred, 1):.1f} KB per image)"
+        )
+        print(
+            f"Render stage: {render_stats['completed']} images, "
+            f"{render_stats['images_per_second']:.2f} images/s, "
+            f"{render_stats['mean_render_seconds']:.3f}s mean render time, "
+            f"queue depth mean {render_stats['mean_queue_depth']:.1f} / "
+            f"peak {render_stats['peak_queue_depth']} of {renderer.max_queue}"
+        )
+        if render_stats["completed"]:
+            sizes = ", ".join(
+                f"{name} {size / 1024 / render_stats['completed']:.1f} KB"
+                for name, size in thumbnail_bytes.items()
             )
-            bboxes = detection_data["<OD>"]["bboxes"]
-            labels = detection_data["<OD>"]["labels"]
-
-            # Update label counts for the treemap and image-to-label mapping
-            image_labels_map[image_path] = labels
-            for label in labels:
-                label_counts[label] = label_counts.get(label, 0) + 1
-
-            img = Image.open(image_path).convert("RGB")
-            draw = ImageDraw.Draw(img)
-            for bbox, label in zip(bboxes, labels):
-                x1, y1, x2, y2 = bbox
-                draw.rectangle([x1, y1, x2, y2], outline="red", width=3)
-                draw.text((x1, y1 - 10), label, fill="red")
-
-            # Save annotated image with a unique filename
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
-            annotated_filename = f"annotated_{os.path.basename(image_path).split('.')[0]}_{timestamp}.png"
-            annotated_path = os.path.join(annotated_dir, annotated_filename)
-            img.save(annotated_path)
-        else:
-            annotated_path = (
-                image_path  # Use original image if no detection is performed
+            print(
+                f"Gallery images per image: {sizes} "
+                f"(originals {original_bytes / 1024 / render_stats['completed']:.1f} KB)"
             )
 
-        # Clean up and format JSON output
-        cleaned_result_dict = {}
-        for key, value in result_dict.items():
-            try:
-                cleaned_result_dict[key] = json.loads(value.replace("'", '"'))
-            except json.JSONDecodeError:
-                cleaned_result_dict[key] = value
 
-        combined_json = clean_keys(cleaned_result_dict)  # Clean keys for readability
+# Delete the annotated copy and gallery derivatives of an image that is being
+# dropped or reprocessed
+def remove_annotated(record):
+    paths = [d["path"] for d in record.get("thumbnails", {}).values()]
+    paths.append(record.get("annotated_path"))
+    paths = {path for path in paths if path and path != record["original_path"]}  # "full" may be the original
+    for path in paths:
+        if os.path.isfile(path):
+            os.unlink(path)
+
+
+def main():
+    args = parse_args()
+    tracer.enabled = args.profile
+
+    # Ensure directories exist
+    if not os.path.exists(image_dir):
+        raise FileNotFoundError(f"The directory {image_dir} does not exist.")
+
+    if not os.path.exists(annotated_dir):
+        os.makedirs(annotated_dir)
+
+    # Scan for images in the directory
+    images = [
+        os.path.join(image_dir, f)
+        for f in os.listdir(image_dir)
+        if f.lower().endswith(supported_formats)
+    ]
+
+    if not images:
+        raise FileNotFoundError(f"No images found in the directory {image_dir}.")
+
+    # Incremental runs diff against the last finished run; --resume also
+    # trusts whatever made it into the results log before a crash
+    previous_entries = load_manifest(manifest_json)["images"] if args.incremental else {}
+    if args.incremental or args.resume:
+        log_index, log_lines = index_results_log(results_log)
+    else:
+        log_index, log_lines = {}, 0
+
+        # Clear the annotated directory
+        for file in os.listdir(annotated_dir):
+            file_path = os.path.join(annotated_dir, file)
+            if os.path.isfile(file_path):
+                os.unlink(file_path)
+
+    if args.resume:
+        previous_entries = {**previous_entries, **{p: e for p, (_, e) in log_index.items()}}
+
+    changes = scan_images(images, previous_entries)
+    entries = changes["entries"]
+    for entry in entries.values():
+        entry["overlay"] = args.overlay
+
+    # Unchanged images are reused as long as their logged result survived and
+    # was produced in the same mode (annotated PNG or overlay)
+    reused = [
+        p
+        for p in changes["unchanged"]
+        if p in log_index and log_index[p][1].get("overlay", False) == args.overlay
+    ]
+    reused_set = set(reused)
+    to_process = [p for p in images if p not in reused_set]
+
+    # Annotated copies of deleted or reprocessed images are now stale
+    stale = [p for p in changes["deleted"] + to_process if p in log_index]
+    if stale:
+        with open(results_log, "rb") as log_file:
+            for image_path in stale:
+                remove_annotated(read_logged(log_file, log_index[image_path][0])["record"])
+
+    if args.incremental or args.resume:
+        print(
+            f"{len(reused)} images reused, {len(changes['added'])} added, "
+            f"{len(changes['modified'])} modified, {len(changes['deleted'])} deleted"
+        )
+
+    # Initialize the Florence endpoint pool
+    pool = BackendPool(
+        args.endpoint or endpoints_from_env(florence_endpoints),
+        health_check_interval,
+        retries=request_retries,
+        retry_backoff=retry_backoff,
+        request_timeout=request_timeout,
+    )
+    pool.start_health_checks()
+
+    # Process each image, appending results to the log as they finish
+    offsets = {p: log_index[p][0] for p in reused}
+    cache = ResultCache(cache_path, cache_max_bytes) if use_cache else None
+    hashes = {p: entries[p]["sha256"] for p in to_process}
+
+    # Reused images seed the dedup index; their results are found through the
+    # cache. Images from runs without --dedup are hashed now, once, since the
+    # hashes are kept in the manifest.
+    dedup = None
+    if args.dedup:
+        dedup = DuplicateIndex(dedup_distance, dedup_max_aspect_change)
+        hashed = 0
+        with tracer.span("dedup.seed"):
+            for p in reused:
+                if not entries[p].get("fingerprint"):
+                    entries[p]["fingerprint"] = image_fingerprint(p)
+                    hashed += 1
+                dedup.add(p, entries[p]["fingerprint"], entries[p]["sha256"])
+        if hashed:
+            print(f"Dedup: hashed {hashed} images from earlier runs")
+    failed = []
+    try:
+        with ResultsLog(results_log, log_sync_every, truncate=not log_index) as log:
+            for image_path, record, labels in process_images(
+                to_process, hashes, pool, cache, args.overlay, dedup, not args.fixed_concurrency
+            ):
+                if record is None:
+                    failed.append(image_path)
+                    continue
+                # Only images whose results were computed are stored as
+                # dedup candidates for later runs
+                if dedup is not None and image_path in dedup.images:
+                    entries[image_path]["fingerprint"] = dedup.images[image_path][0]
+                with tracer.span("log.append", image=os.path.basename(image_path)):
+                    offsets[image_path] = log.append(record, labels, entries[image_path])
+                log_lines += 1
+    finally:
+        print(pool.report())
+        pool.close()
+        if cache is not None:
+            print(cache.report())
+            cache.close()
+
+    # Failed images are left out of the gallery and the manifest, so the next
+    # --incremental or --resume run retries them
+    if failed:
+        failed_set = set(failed)
+        images = [p for p in images if p not in failed_set]
+        for image_path in failed:
+            del entries[image_path]
+        print(f"{len(failed)} images failed and will be retried by the next --incremental or --resume run")
+
+    # Build the gallery JSON (or its shards), the label facet index, the
+    # detection store and the optional catalog by streaming over the log.
+    # Image IDs are positions in image_data.json, or in shard order.
+    label_index = LabelIndex()
+    detection_store = DetectionStore()
+    if args.shards:
+        items = write_gallery_shards(gallery_dir, results_log, offsets, images, shard_size)
+    else:
+        items = write_image_data(output_json, results_log, offsets, images)
+    catalog_writer = CatalogWriter(catalog_db, florence_model) if args.catalog else nullcontext()
+    with tracer.span("image_data.write"), catalog_writer as catalog:
+        for image_id, item in enumerate(items):
+            labels = item["labels"]
+            record = item["record"]
+            image_path = record["original_path"]
+            entries[image_path]["labels"] = labels
+            if labels is not None:
+                label_index.add(image_id, labels)
+                detection_store.add(image_id, record_bboxes(record), labels)
+            if catalog is not None:
+                catalog.add(image_id, record, labels, record_bboxes(record), entries[image_path])
+    label_index.image_count = len(images)
+    detection_store.image_count = len(images)
 
-        # Use "Caption" as the title for the modal
-        modal_title = cleaned_result_dict.get("Caption", {}).get("", "Image")
+    if not args.shards:
+        print(f"JSON data saved as: {output_json}")
+    if args.catalog:
+        print(f"Catalog saved as: {catalog_db}")
 
-        image_results.append(
+    with tracer.span("label_index.save"):
+        label_index.save(label_index_json)
+    print(f"Label index saved as: {label_index_json}")
+
+    with tracer.span("detections.save"):
+        detection_store.save(detections_dir)
+    print(f"Detection store saved as: {detections_dir}/ ({len(detection_store)} boxes)")
+
+    # Treemap counts come straight from the detection store
+    label_counts = detection_store.label_counts()
+
+    # server.py treats line i of the log as image ID i, so rewrite the log
+    # whenever it holds stale lines or is out of gallery order
+    ordered = [offsets[p] for p in images]
+    if log_lines > len(images) or any(b <= a for a, b in zip(ordered, ordered[1:])):
+        with tracer.span("log.compact"):
+            compact_results_log(results_log, offsets, images)
+
+    with tracer.span("manifest.save"):
+        save_manifest(
+            manifest_json,
             {
-                "original_path": image_path,
-                "annotated_path": annotated_path,
-                "combined_json": combined_json,
-                "modal_title": modal_title,
-            }
+                "images": entries,
+                "label_counts": label_counts,
+                "results_log_size": os.path.getsize(results_log),  # Lets server.py spot a mid-ingest log
+            },
         )
 
-        def reformat_result(result_dict):
-            for key in list(result_dict.keys()):
-                value = result_dict[key]
-                # Check if value is a nested dictionary with an empty string as key
-                if isinstance(value, dict) and "" in value:
-                    result_dict[key] = value[""]
+    with tracer.span("label_totals.save"):
+        save_label_totals(label_totals_json, len(images), label_counts)
+
+    # Only one gallery format is kept, so the viewer never loads stale data
+    if args.shards:
+        with tracer.span("gallery_manifest.save"):
+            gallery_manifest = save_gallery_manifest(gallery_dir, len(images), shard_size, label_counts)
+        if os.path.exists(output_json):
+            os.unlink(output_json)
+        print(f"Gallery shards saved as: {gallery_dir}/ (manifest {gallery_manifest})")
+    elif os.path.isdir(gallery_dir):
+        shutil.rmtree(gallery_dir)
 
-            # Convert to JSON with proper formatting
-            return json.dumps(result_dict, indent=4)
+    # A catalog from an earlier --catalog run would map IDs to other images
+    if not args.catalog and os.path.exists(catalog_db):
+        os.unlink(catalog_db)
 
+    # Save HTML to file; the viewer fetches its data, nothing is inlined
+    with tracer.span("html.build"):
+        html = build_html()
+    with tracer.span("html.write"), open(output_html, "w") as html_file:
+        html_file.write(html)
 
-# Prepare the treemap data
-treemap_data = {
-    "name": "Root",
-    "children": [
-        {"name": label, "value": count} for label, count in label_counts.items()
-    ],
-}
+    print(f"HTML gallery saved as: {output_html}")
 
-# Save the JSON data
-data = {"images": image_results}
-with open(output_json, "w") as json_file:
-    json.dump(data, json_file, indent=2)
+    if args.profile:
+        tracer.save(profile_trace_json)
+        print(tracer.summary())
+        print(f"Trace saved as: {profile_trace_json} (open in https://ui.perfetto.dev or chrome://tracing)")
+
+    # Start the server
+    subprocess.Popen(["start", "cmd", "/k", "python server.py"], shell=True)
 
-print(f"JSON data saved as: {output_json}")
 
 # Generate HTML
-html_content = f"""
+def build_html():
+    return f"""
 <!DOCTYPE html>
 <html lang="en">
   <head>
@@ -181,10 +785,30 @@ html_content = f"""
     <link rel="icon" href="haystack.png" type="image/png" />
     <style>
       .gallery-img {{
-        max-height: 225px;
+        width: 100%;
+        height: 225px;
         object-fit: cover;
         cursor: pointer;
       }}
+      .gallery-viewport {{
+        height: 80vh;
+        overflow-y: auto;
+        margin-top: 10px;
+      }}
+      .gallery-spacer {{
+        position: relative;
+      }}
+      .gallery-cell {{
+        position: absolute;
+        top: 0;
+        left: 0;
+        padding: 8px;
+        contain: strict;
+      }}
+      .gallery-cell .card {{
+        height: 100%;
+        overflow: hidden;
+      }}
       pre {{
         background-color: #f8f9fa;
         border: 1px solid #ddd;
@@ -220,6 +844,33 @@ html_content = f"""
         width: 100%; /* Ensures it spans the full width of the viewport */
         background-color: #f8f9fa; /* Optional, adds a background color */
       }}
+      .image-frame {{
+        position: relative;
+      }}
+      .image-frame img {{
+        display: block;
+      }}
+      .overlay {{
+        position: absolute;
+        top: 0;
+        left: 0;
+        width: 100%;
+        height: 100%;
+        pointer-events: none;
+      }}
+      .overlay rect {{
+        fill: none;
+        stroke: red;
+        stroke-width: 3px;
+        vector-effect: non-scaling-stroke;
+      }}
+      .overlay text {{
+        fill: red;
+      }}
+      .hide-boxes .overlay,
+      .hide-labels .overlay text {{
+        display: none;
+      }}
       #reset-button {{
         margin-top: 20px;
       }}
@@ -307,12 +958,17 @@ html_content = f"""
         <section class="album py-5 text-center container">
           <h2 class="fw-light">Object Detection Gallery</h2>
           <button id="reset-button" class="btn btn-primary">Reset Gallery</button>
-          <div class="row row-cols-1 row-cols-sm-1 row-cols-md-1 g-3">
-            <div id="gallery" class="row row-cols-1 row-cols-sm-2 row-cols-md-3 g-3"></div>
+          <div class="form-check form-switch d-inline-block ms-3">
+            <input class="form-check-input" type="checkbox" id="toggle-boxes" checked />
+            <label class="form-check-label" for="toggle-boxes">Boxes</label>
+          </div>
+          <div class="form-check form-switch d-inline-block ms-2">
+            <input class="form-check-input" type="checkbox" id="toggle-labels" checked />
+            <label class="form-check-label" for="toggle-labels">Labels</label>
           </div>
-          <div class="text-center mt-4">
-            <button id="prev-page" class="btn btn-primary page-btn">Previous</button>
-            <button id="next-page" class="btn btn-primary page-btn">Next</button>
+          <p id="gallery-count" class="text-muted mt-3 mb-0"></p>
+          <div id="gallery-viewport" class="gallery-viewport">
+            <div id="gallery" class="gallery-spacer"></div>
           </div>
         </section>
         <section class="album py-5 text-center">
@@ -324,6 +980,22 @@ html_content = f"""
       <svg id="treemap-svg"></svg>
     </div>
 
+    <div class="modal fade" id="image-modal" tabindex="-1" aria-labelledby="image-modal-title">
+      <div class="modal-dialog modal-fullscreen">
+        <div class="modal-content">
+          <div class="modal-header">
+            <h5 class="modal-title" id="image-modal-title"></h5>
+            <button type="button" class="btn-close" data-bs-dismiss="modal" aria-label="Close"></button>
+          </div>
+          <div class="modal-body">
+            <div class="image-frame" id="image-modal-frame">
+              <img id="image-modal-img" class="img-fluid" decoding="async" alt="" />
+            </div>
+          </div>
+        </div>
+      </div>
+    </div>
+
     <footer class="text-muted py-5">
       <div class="container">
         <p class="mb-1">Needle in a Haystack &copy; 2024. Created using Python. Author: Daniel Penrod.</p>
@@ -335,199 +1007,602 @@ html_content = f"""
     <script src="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/highlight.min.js"></script>
 
     <script>
-      const jsonFile = "image_data.json";
-      const itemsPerPage = 6;
-      let currentPage = 1;
-      let totalPages = 1;
-      let imageData = [];
-      var treemapData = {json.dumps(treemap_data)};
-      var image_labels_map = {json.dumps(image_labels_map)};
+      const apiUrl = "api/images";
+      const jsonFile = "{output_json}";
+      const labelIndexFile = "{label_index_json}";
+      const labelTotalsFile = "{label_totals_json}";
+      const galleryDir = "{gallery_dir}/";
+      let useApi = true;
+      let labelIndex = null;
+      let currentQuery = "";
+      let imageData = null; // Only loaded for a single-file gallery without the query API
+      const maxCachedShards = 8;
+      const shardCache = new Map(); // Shard number -> promise of its images, least recently used first
       var width = 800;
       var height = 600;
 
-      var root = d3.hierarchy(treemapData).sum(function (d) {{
-        return d.value;
-      }});
-
-      d3.treemap().size([width, height]).padding(2)(root);
+      // Manifest of a sharded gallery (start.py --shards): image count, label
+      // totals and shard ranges. null when the gallery is a single JSON file.
+      let galleryManifest = null;
+      function fetchGalleryManifest() {{
+        if (galleryManifest === null) {{
+          galleryManifest = fetch(galleryDir + "manifest.json", {{ cache: "no-cache" }})
+            .then((response) => (response.ok ? response.json() : null))
+            .catch(() => null);
+        }}
+        return galleryManifest;
+      }}
 
-      var colorScale = d3.scaleOrdinal(d3.schemeCategory10);
+      // Label totals for the treemap from the small file start.py writes in
+      // both gallery modes
+      async function fetchLabelTotals() {{
+        const response = await fetch(labelTotalsFile, {{ cache: "no-cache" }});
+        return response.ok ? (await response.json()).label_totals || {{}} : {{}};
+      }}
 
-      var svg = d3.select("#treemap-svg").attr("width", width).attr("height", height);
+      function drawTreemap(labelTotals) {{
+        var treemapData = {{
+          name: "Root",
+          children: Object.entries(labelTotals).map(([name, value]) => ({{ name: name, value: value }})),
+        }};
 
-      var nodes = svg
-        .selectAll("g")
-        .data(root.leaves())
-        .enter()
-        .append("g")
-        .attr("transform", function (d) {{
-          return "translate(" + d.x0 + "," + d.y0 + ")";
+        var root = d3.hierarchy(treemapData).sum(function (d) {{
+          return d.value;
         }});
 
-      nodes
-        .append("rect")
-        .attr("width", function (d) {{
-          return d.x1 - d.x0;
-        }})
-        .attr("height", function (d) {{
-          return d.y1 - d.y0;
-        }})
-        .attr("fill", function (d) {{
-          return colorScale(d.data.name);
-        }})
-        .attr("stroke", "#fff")
-        .style("cursor", "pointer")
-        .on("click", function (event, d) {{
-          var label = d.data.name;
-          filterGalleryByLabel(label);
-        }});
+        d3.treemap().size([width, height]).padding(2)(root);
+
+        var colorScale = d3.scaleOrdinal(d3.schemeCategory10);
+
+        var svg = d3.select("#treemap-svg").attr("width", width).attr("height", height);
+
+        var nodes = svg
+          .selectAll("g")
+          .data(root.leaves())
+          .enter()
+          .append("g")
+          .attr("transform", function (d) {{
+            return "translate(" + d.x0 + "," + d.y0 + ")";
+          }});
 
-      nodes
-        .append("text")
-        .attr("dx", 5)
-        .attr("dy", 15)
-        .text(function (d) {{
-          return d.data.name + " (" + d.data.value + ")";
-        }})
-        .attr("fill", "#fff")
-        .attr("font-size", "12px");
+        nodes
+          .append("rect")
+          .attr("width", function (d) {{
+            return d.x1 - d.x0;
+          }})
+          .attr("height", function (d) {{
+            return d.y1 - d.y0;
+          }})
+          .attr("fill", function (d) {{
+            return colorScale(d.data.name);
+          }})
+          .attr("stroke", "#fff")
+          .style("cursor", "pointer")
+          .on("click", function (event, d) {{
+            var label = d.data.name;
+            filterGalleryByQuery('"' + label + '"');
+          }});
+
+        nodes
+          .append("text")
+          .attr("dx", 5)
+          .attr("dy", 15)
+          .text(function (d) {{
+            return d.data.name + " (" + d.data.value + ")";
+          }})
+          .attr("fill", "#fff")
+          .attr("font-size", "12px");
+      }}
+
+      fetchLabelTotals().then(drawTreemap);
 
       // Reset functionality using the reset button
       document.getElementById("reset-button").addEventListener("click", function () {{
-        renderGallery();
+        document.getElementById("search-box").value = "";
+        showQuery("");
       }});
 
-      // Search functionality
+      // Search functionality: label queries such as person AND NOT car
       document.getElementById("search-box").addEventListener("input", function () {{
-        var searchValue = this.value.toLowerCase();
+        var searchValue = this.value.trim();
         if (searchValue) {{
-          filterGalleryByLabel(searchValue);
+          filterGalleryByQuery(searchValue);
         }} else {{
-          renderGallery();
+          showQuery("");
         }}
       }});
 
-      function filterGalleryByLabel(label) {{
-        const gallery = document.getElementById("gallery");
-        gallery.innerHTML = "";
+      // Label facet index: one bitmap of image IDs per label, built by start.py
+      async function fetchLabelIndex() {{
+        const response = await fetch(labelIndexFile);
+        const data = await response.json();
+        const words = Math.ceil(data.image_count / 32);
+        labelIndex = {{
+          imageCount: data.image_count,
+          words: words,
+          labels: data.labels,
+          labelIds: new Map(data.labels.map((label, i) => [label.toLowerCase(), i])),
+          bitmaps: data.bitmaps.map((encoded) => decodeBitmap(encoded, words)),
+        }};
+      }}
+
+      function decodeBitmap(encoded, words) {{
+        const bytes = Uint8Array.from(atob(encoded), (c) => c.charCodeAt(0));
+        const bitmap = new Uint32Array(words);
+        new Uint8Array(bitmap.buffer).set(bytes.subarray(0, words * 4));
+        return bitmap;
+      }}
+
+      // Evaluate AND / OR / NOT / parentheses over label bitmaps, word by word
+      function queryLabels(expression) {{
+        const tokens = expression.match(/\\(|\\)|"[^"]*"|[^\\s()"]+/g) || [];
+        const operators = ["AND", "OR", "NOT"];
+        let position = 0;
+
+        const peek = () => tokens[position];
+        const isOperator = (token, name) => token !== undefined && token.toUpperCase() === name;
+        const combine = (a, b, op) => {{
+          const out = new Uint32Array(labelIndex.words);
+          for (let w = 0; w < out.length; w++) out[w] = op(a[w], b[w]);
+          return out;
+        }};
+        const lookup = (label) => {{
+          const id = labelIndex.labelIds.get(label.toLowerCase());
+          return id === undefined ? new Uint32Array(labelIndex.words) : labelIndex.bitmaps[id];
+        }};
+        const allImages = () => {{
+          const out = new Uint32Array(labelIndex.words).fill(0xffffffff);
+          const extra = labelIndex.imageCount % 32;
+          if (extra) out[out.length - 1] = 2 ** extra - 1;
+          return out;
+        }};
+
+        function parseOr() {{
+          let result = parseAnd();
+          while (isOperator(peek(), "OR")) {{
+            position++;
+            result = combine(result, parseAnd(), (a, b) => a | b);
+          }}
+          return result;
+        }}
+
+        function parseAnd() {{
+          let result = parseNot();
+          while (isOperator(peek(), "AND")) {{
+            position++;
+            result = combine(result, parseNot(), (a, b) => a & b);
+          }}
+          return result;
+        }}
+
+        function parseNot() {{
+          if (isOperator(peek(), "NOT")) {{
+            position++;
+            return combine(allImages(), parseNot(), (a, b) => a & ~b);
+          }}
+          if (peek() === "(") {{
+            position++;
+            const result = parseOr();
+            if (peek() !== ")") throw new Error("Missing ')'");
+            position++;
+            return result;
+          }}
+          return parseLabel();
+        }}
+
+        function parseLabel() {{
+          const token = peek();
+          if (token === undefined || token === ")" || operators.includes(token.toUpperCase())) {{
+            throw new Error("Expected a label");
+          }}
+          if (token.startsWith('"')) {{
+            position++;
+            return lookup(token.replace(/"/g, ""));
+          }}
+          const words = [];
+          while (
+            peek() !== undefined &&
+            peek() !== "(" &&
+            peek() !== ")" &&
+            !peek().startsWith('"') &&
+            !operators.includes(peek().toUpperCase())
+          ) {{
+            words.push(peek());
+            position++;
+          }}
+          return lookup(words.join(" "));
+        }}
+
+        const result = parseOr();
+        if (position !== tokens.length) throw new Error("Unexpected " + tokens[position]);
+        return result;
+      }}
+
+      function bitmapToIds(bitmap) {{
+        const ids = [];
+        for (let w = 0; w < bitmap.length; w++) {{
+          let word = bitmap[w];
+          while (word) {{
+            ids.push(w * 32 + 31 - Math.clz32(word & -word));
+            word &= word - 1;
+          }}
+        }}
+        return ids;
+      }}
+
+      // Images of one shard, fetched on first use and kept in a small LRU
+      function fetchShard(manifest, shard) {{
+        let promise = shardCache.get(shard);
+        if (promise === undefined) {{
+          const url = galleryDir + manifest.shards[shard].path + "?v=" + manifest.version;
+          promise = fetch(url)
+            .then((response) => {{
+              if (!response.ok) throw new Error("Failed to load " + url);
+              return response.json();
+            }})
+            .then((data) => data.images);
+          promise.catch(() => shardCache.delete(shard));
+        }}
+        shardCache.delete(shard);
+        shardCache.set(shard, promise);
+        while (shardCache.size > maxCachedShards) shardCache.delete(shardCache.keys().next().value);
+        return promise;
+      }}
+
+      async function shardImages(manifest, ids) {{
+        const shards = await Promise.all(ids.map((id) => fetchShard(manifest, Math.floor(id / manifest.shard_size))));
+        return ids.map((id, k) => shards[k][id % manifest.shard_size]);
+      }}
+
+      // Labels of an image in a single-file gallery, read from the label index
+      function imageLabels(id) {{
+        const word = id >> 5;
+        const bit = 1 << (id & 31);
+        return labelIndex.labels.filter((_, l) => labelIndex.bitmaps[l][word] & bit);
+      }}
+
+      // One page of results: server.py's query API when available, otherwise
+      // the gallery shards (or image_data.json) and label_index.json filtered
+      // in the browser
+      async function loadPage(query, page) {{
+        if (useApi) {{
+          const params = new URLSearchParams({{ page: page, limit: pageSize }});
+          if (query) params.set("label", query);
+          const response = await fetch(apiUrl + "?" + params);
+          if (response.ok) return await response.json();
+          if (response.status === 400) throw new Error((await response.json()).error);
+          useApi = false;
+        }}
+
+        const manifest = await fetchGalleryManifest();
+        if (!manifest && imageData === null) {{
+          const response = await fetch(jsonFile);
+          imageData = (await response.json()).images;
+        }}
+        if (labelIndex === null && (query || !manifest)) await fetchLabelIndex();
+
+        const ids = query ? bitmapToIds(queryLabels(query)) : null;
+        const total = ids ? ids.length : manifest ? manifest.image_count : imageData.length;
+        const start = (page - 1) * pageSize;
+        const pageIds = [];
+        for (let k = start; k < Math.min(start + pageSize, total); k++) pageIds.push(ids ? ids[k] : k);
+
+        let images;
+        if (manifest) {{
+          images = await shardImages(manifest, pageIds);
+          // Start loading the shard the next page needs
+          const next = start + pageSize;
+          if (next < total) fetchShard(manifest, Math.floor((ids ? ids[next] : next) / manifest.shard_size)).catch(() => {{}});
+        }} else {{
+          images = pageIds.map((id) => ({{ ...imageData[id], id: id, labels: imageLabels(id) }}));
+        }}
+        return {{
+          total: total,
+          page: page,
+          pages: Math.ceil(total / pageSize),
+          images: images,
+        }};
+      }}
 
-        const filteredImages = imageData.filter((image) => {{
-          const labels = (image_labels_map[image.original_path] || []).join(",").toLowerCase();
-          return labels.includes(label.toLowerCase());
+      // Card and modal sources from the WebP derivatives written by start.py;
+      // the browser picks a size from srcset. Records from before the
+      // derivatives existed fall back to the annotated image.
+      function imageSources(image) {{
+        const thumbnails = image.thumbnails;
+        if (!thumbnails) {{
+          return {{ card: image.annotated_path, full: image.annotated_path, srcset: "" }};
+        }}
+        const widths = new Map();
+        Object.values(thumbnails).forEach((t) => {{
+          if (!widths.has(t.width)) widths.set(t.width, t.path);
         }});
+        const srcset = Array.from(widths, ([width, path]) => path + " " + width + "w").join(", ");
+        return {{ card: (thumbnails.small || thumbnails.full).path, full: thumbnails.full.path, srcset: srcset }};
+      }}
+
+      function escapeHtml(text) {{
+        const div = document.createElement("div");
+        div.textContent = text;
+        return div.innerHTML;
+      }}
+
+      // Bounding boxes of overlay-mode records (start.py --overlay), drawn as
+      // SVG in image pixel coordinates over the card or modal image. fit
+      // matches the image's object-fit: "slice" for cover, "meet" otherwise.
+      function overlaySvg(image, fit) {{
+        const detections = image.detections;
+        if (!detections || !image.width) return "";
+        const fontSize = Math.max(image.width, image.height) / 50;
+        const shapes = detections.bboxes
+          .map(([x1, y1, x2, y2], k) => {{
+            const textY = Math.max(fontSize, y1 - fontSize / 4);
+            return (
+              `<rect x="${{x1}}" y="${{y1}}" width="${{x2 - x1}}" height="${{y2 - y1}}"></rect>` +
+              `<text x="${{x1}}" y="${{textY}}" font-size="${{fontSize}}">${{escapeHtml(detections.labels[k])}}</text>`
+            );
+          }})
+          .join("");
+        return `<svg class="overlay" viewBox="0 0 ${{image.width}} ${{image.height}}" preserveAspectRatio="xMidYMid ${{fit}}">${{shapes}}</svg>`;
+      }}
+
+      // Virtualized gallery: only the rows in view (plus overscan) are in the
+      // DOM, as a fixed pool of absolutely positioned cells that are rebound
+      // while scrolling. Results are fetched a page at a time and kept per
+      // query; the pool size depends on the viewport, not on the result count.
+      const pageSize = 60;
+      const rowHeight = 500; // Card image, JSON block and padding
+      const overscanRows = 2;
+      const maxSpacerHeight = 8000000; // Browsers cap element heights; taller galleries scroll proportionally
+      const maxCachedPages = 20;
+      const maxHighlighted = 500;
+      const highlightBudgetMs = 8; // Highlighting per frame, so scrolling stays smooth
+      const viewport = document.getElementById("gallery-viewport");
+      const gallery = document.getElementById("gallery");
+      const modalElement = document.getElementById("image-modal");
+      const modalFrame = document.getElementById("image-modal-frame");
+      const modalImage = document.getElementById("image-modal-img");
+      let latestRequest = 0;
+      let queryGeneration = 0;
+      let total = 0;
+      let columns = 1;
+      let cells = [];
+      let resultPages = new Map(); // Page number -> images, or null while loading
+      const highlighted = new Map(); // Image ID -> highlighted JSON, oldest first
+      let updateScheduled = false;
+
+      async function showQuery(query) {{
+        const request = ++latestRequest;
+        let result;
+        try {{
+          result = await loadPage(query, 1);
+        }} catch (e) {{
+          return; // Incomplete query while typing; keep the current results
+        }}
+        if (request !== latestRequest) return; // Superseded by a newer request
+
+        queryGeneration++;
+        currentQuery = query;
+        total = result.total;
+        resultPages = new Map([[1, result.images]]);
+        document.getElementById("gallery-count").textContent = total + (total === 1 ? " image" : " images");
+        viewport.scrollTop = 0;
+        cells.forEach((cell) => (cell.index = -1));
+        scheduleUpdate();
+      }}
 
-        filteredImages.forEach((image, i) => {{
-          const col = document.createElement("div");
-          col.className = "col";
-          col.innerHTML = `
-          <div class="col gallery-item" data-labels="${{(image_labels_map[image.original_path] || []).join(",")}}">
+      function filterGalleryByQuery(query) {{
+        showQuery(query);
+      }}
+
+      function requestPage(page) {{
+        const generation = queryGeneration;
+        resultPages.set(page, null);
+        loadPage(currentQuery, page)
+          .then((result) => {{
+            if (generation !== queryGeneration) return;
+            resultPages.set(page, result.images);
+            for (const [cached] of resultPages) {{
+              if (resultPages.size <= maxCachedPages) break;
+              if (cached !== page && resultPages.get(cached) !== null) resultPages.delete(cached);
+            }}
+            scheduleUpdate();
+          }})
+          .catch(() => {{
+            if (generation === queryGeneration) resultPages.delete(page);
+          }});
+      }}
+
+      // Image at a result position, or null while its page is loading
+      function imageAt(index) {{
+        const page = Math.floor(index / pageSize) + 1;
+        const images = resultPages.get(page);
+        if (images === undefined) requestPage(page);
+        return images ? images[index % pageSize] || null : null;
+      }}
+
+      function columnCount() {{
+        const width = viewport.clientWidth;
+        return width >= 720 ? 3 : width >= 500 ? 2 : 1;
+      }}
+
+      function buildCells() {{
+        columns = columnCount();
+        const cardWidth = Math.ceil(viewport.clientWidth / columns) + "px"; // For srcset
+        const rows = Math.ceil(viewport.clientHeight / rowHeight) + 2 * overscanRows + 1;
+        gallery.textContent = "";
+        cells = [];
+        for (let k = 0; k < rows * columns; k++) {{
+          const element = document.createElement("div");
+          element.className = "gallery-cell";
+          element.hidden = true;
+          element.style.width = 100 / columns + "%";
+          element.style.height = rowHeight + "px";
+          element.innerHTML = `
             <div class="card shadow-sm">
-              <img src="${{
-                image.annotated_path
-              }}" class="bd-placeholder-img card-img-top gallery-img" alt="Image ${{i}}" data-bs-toggle="modal" data-bs-target="#modal${{i}}">
-              <div class="card-body">
-                <pre><code class="language-json">${{JSON.stringify(image.combined_json, null, 2)}}</code></pre>
+              <div class="image-frame">
+                <img class="card-img-top gallery-img" sizes="${{cardWidth}}" decoding="async" alt="" />
               </div>
-            </div>
-          </div>
-          <div class="modal fade" id="modal${{i}}" tabindex="-1" aria-labelledby="modalLabel${{i}}" aria-hidden="true">
-            <div class="modal-dialog modal-fullscreen">
-              <div class="modal-content">
-                <div class="modal-header">
-                  <h5 class="modal-title" id="modalLabel${{i}}">${{(image_labels_map[image.original_path] || []).join(",")}}</h5>
-                  <button type="button" class="btn-close" data-bs-dismiss="modal" aria-label="Close"></button>
-                </div>
-                <div class="modal-body">
-                  <img src="${{image.annotated_path}}" class="img-fluid" alt="Annotated Image ${{i}}">
-                </div>
+              <div class="card-body">
+                <pre><code class="language-json hljs"></code></pre>
               </div>
-            </div>
-          </div>
-          `;
-          gallery.appendChild(col);
+            </div>`;
+          gallery.appendChild(element);
+          cells.push({{
+            element: element,
+            frame: element.querySelector(".image-frame"),
+            img: element.querySelector("img"),
+            code: element.querySelector("code"),
+            index: -1,
+            imageId: null,
+            highlight: false,
+          }});
+        }}
+        scheduleUpdate();
+      }}
+
+      function scheduleUpdate() {{
+        if (updateScheduled) return;
+        updateScheduled = true;
+        requestAnimationFrame(() => {{
+          updateScheduled = false;
+          updateCells();
         }});
+      }}
 
-        hljs.highlightAll();
+      // Top of the view in gallery coordinates. Past maxSpacerHeight the
+      // scrollbar maps proportionally onto the full gallery height.
+      function galleryTop() {{
+        const content = Math.ceil(total / columns) * rowHeight;
+        const spacer = Math.min(content, maxSpacerHeight);
+        gallery.style.height = spacer + "px";
+        const range = spacer - viewport.clientHeight;
+        if (content === spacer || range <= 0) return viewport.scrollTop;
+        return (viewport.scrollTop * (content - viewport.clientHeight)) / range;
       }}
 
-      async function fetchData() {{
-        const response = await fetch(jsonFile);
-        const data = await response.json();
-        imageData = data.images;
-        totalPages = Math.ceil(imageData.length / itemsPerPage);
-        renderGallery();
-      }}
-
-      function renderGallery() {{
-        const gallery = document.getElementById("gallery");
-        gallery.innerHTML = "";
-        const startIdx = (currentPage - 1) * itemsPerPage;
-        const endIdx = Math.min(startIdx + itemsPerPage, imageData.length);
-
-        for (let i = startIdx; i < endIdx; i++) {{
-          const image = imageData[i];
-          const col = document.createElement("div");
-          col.className = "col";
-          col.innerHTML = `
-          <div class="col gallery-item" data-labels="${{(image_labels_map[image.original_path] || []).join(",")}}">
-            <div class="card shadow-sm">
-             <img src="${{
-               image.annotated_path
-             }}" class="bd-placeholder-img card-img-top gallery-img" alt="Image ${{i}}" data-bs-toggle="modal" data-bs-target="#modal${{i}}">
-             <div class="card-body">
-                <pre><code class="language-json">${{JSON.stringify(image.combined_json, null, 2)}}</code></pre>
-             </div>
-            </div>
-          </div>
-           <div class="modal fade" id="modal${{i}}" tabindex="-1" aria-labelledby="modalLabel${{i}}">
-                <div class="modal-dialog modal-fullscreen">
-                  <div class="modal-content">
-                    <div class="modal-header">
-                      <h5 class="modal-title" id="modalLabel${{i}}">${{(image_labels_map[image.original_path] || []).join(",")}}</h5>
-                      <button type="button" class="btn-close" data-bs-dismiss="modal" aria-label="Close"></button>
-                    </div>
-                    <div class="modal-body">
-                      <img src="${{image.annotated_path}}" class="img-fluid" alt="Annotated Image ${{i}}">
-                    </div>
-                  </div>
-                </div>
-              </div>
-          `;
-          gallery.appendChild(col);
+      // Position i always uses cell i % cells.length, so scrolling only
+      // rebinds the cells that come into view
+      function updateCells() {{
+        const top = galleryTop();
+        const shift = viewport.scrollTop - top;
+        const first = Math.max(0, Math.floor(top / rowHeight) - overscanRows) * columns;
+        for (let index = first; index < first + cells.length; index++) {{
+          const cell = cells[index % cells.length];
+          if (index >= total) {{
+            cell.element.hidden = true;
+            cell.index = -1;
+            continue;
+          }}
+          const transform = `translate(${{(index % columns) * 100}}%, ${{Math.floor(index / columns) * rowHeight + shift}}px)`;
+          if (cell.element.style.transform !== transform) cell.element.style.transform = transform;
+          if (cell.index !== index) {{
+            cell.element.hidden = false;
+            cell.index = index;
+            cell.imageId = null;
+          }}
+          const image = imageAt(index);
+          if (image === null) {{
+            clearCell(cell);
+          }} else if (cell.imageId !== image.id) {{
+            bindCell(cell, image);
+          }}
         }}
+        highlightVisible(top);
+      }}
 
-        hljs.highlightAll();
+      function clearCell(cell) {{
+        if (cell.imageId === null && !cell.img.hasAttribute("src")) return;
+        cell.imageId = null;
+        cell.img.removeAttribute("srcset");
+        cell.img.removeAttribute("src");
+        cell.frame.querySelector(".overlay")?.remove();
+        cell.code.textContent = "";
+        cell.highlight = false;
       }}
 
-      document.getElementById("prev-page").addEventListener("click", () => {{
-        if (currentPage > 1) {{
-          currentPage--;
-          renderGallery();
+      function bindCell(cell, image) {{
+        const sources = imageSources(image);
+        cell.imageId = image.id;
+        cell.img.srcset = sources.srcset;
+        cell.img.src = sources.card;
+        cell.img.alt = "Image " + image.id;
+        cell.img.dataset.index = cell.index;
+        cell.frame.querySelector(".overlay")?.remove();
+        cell.frame.insertAdjacentHTML("beforeend", overlaySvg(image, "slice"));
+        const html = highlighted.get(image.id);
+        if (html !== undefined) {{
+          cell.code.innerHTML = html;
+          cell.highlight = false;
+        }} else {{
+          cell.code.textContent = JSON.stringify(image.combined_json, null, 2);
+          cell.highlight = true;
         }}
-      }});
+      }}
 
-      document.getElementById("next-page").addEventListener("click", () => {{
-        if (currentPage < totalPages) {{
-          currentPage++;
-          renderGallery();
+      // Highlight JSON of the cells on screen only, within a per-frame budget;
+      // the rest is picked up on the next frame
+      function highlightVisible(top) {{
+        const started = performance.now();
+        const bottom = top + viewport.clientHeight;
+        for (const cell of cells) {{
+          if (!cell.highlight || cell.index < 0) continue;
+          const y = Math.floor(cell.index / columns) * rowHeight;
+          if (y + rowHeight < top || y > bottom) continue;
+          if (performance.now() - started > highlightBudgetMs) {{
+            scheduleUpdate();
+            return;
+          }}
+          const html = hljs.highlight(cell.code.textContent, {{ language: "json" }}).value;
+          highlighted.set(cell.imageId, html);
+          if (highlighted.size > maxHighlighted) highlighted.delete(highlighted.keys().next().value);
+          cell.code.innerHTML = html;
+          cell.highlight = false;
         }}
+      }}
+
+      // One modal for the whole gallery, filled in when a card is clicked
+      gallery.addEventListener("click", (event) => {{
+        const img = event.target.closest(".gallery-img");
+        if (!img || img.dataset.index === undefined) return;
+        const image = imageAt(Number(img.dataset.index));
+        if (image === null) return;
+        const sources = imageSources(image);
+        document.getElementById("image-modal-title").textContent = image.labels.join(",");
+        modalImage.src = sources.full;
+        modalImage.alt = "Annotated Image " + image.id;
+        modalFrame.querySelector(".overlay")?.remove();
+        modalFrame.insertAdjacentHTML("beforeend", overlaySvg(image, "meet"));
+        bootstrap.Modal.getOrCreateInstance(modalElement).show();
+      }});
+
+      viewport.addEventListener("scroll", scheduleUpdate, {{ passive: true }});
+
+      let resizeScheduled = false;
+      window.addEventListener("resize", () => {{
+        if (resizeScheduled) return;
+        resizeScheduled = true;
+        requestAnimationFrame(() => {{
+          resizeScheduled = false;
+          buildCells();
+        }});
       }});
 
-      fetchData();
+      // Overlay toggles; they only affect images drawn in overlay mode
+      document.getElementById("toggle-boxes").addEventListener("change", function () {{
+        document.body.classList.toggle("hide-boxes", !this.checked);
+      }});
 
-      document.addEventListener("DOMContentLoaded", () => {{
-        hljs.highlightAll();
+      document.getElementById("toggle-labels").addEventListener("change", function () {{
+        document.body.classList.toggle("hide-labels", !this.checked);
       }});
+
+      buildCells();
+      showQuery("");
     </script>
   </body>
 </html>
 """
 
-# Save HTML to file
-with open(output_html, "w") as html_file:
-    html_file.write(html_content)
-
-print(f"HTML gallery saved as: {output_html}")
 
-# Start the server
-subprocess.Popen(["start", "cmd", "/k", "python server.py"], shell=True)
+if __name__ == "__main__":
+    main()
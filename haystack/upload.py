@@ -0,0 +1,122 @@
+import ast
+import os
+import tempfile
+import threading
+import httpx
+from gradio_client import handle_file
+from PIL import Image
+
+
+# Re-encode an image so its longest side is at most max_side. Florence-2
+# resizes its input internally anyway, so sending the full-size file only
+# costs upload bytes and server-side decode time. Returns the path to send
+# and the (x, y) factors that map coordinates on it back to the original.
+def prepare_upload(image_path, max_side, image_format="JPEG", quality=90, tmp_dir=None):
+    if not max_side:
+        return image_path, (1.0, 1.0)
+
+    with Image.open(image_path) as img:
+        width, height = img.size
+        if max(width, height) <= max_side:
+            return image_path, (1.0, 1.0)
+
+        ratio = max_side / max(width, height)
+        size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+        resized = img.convert("RGB").resize(size, Image.LANCZOS)
+
+    extension = ".webp" if image_format.upper() == "WEBP" else ".jpg"
+    fd, upload_path = tempfile.mkstemp(suffix=extension, dir=tmp_dir)
+    os.close(fd)
+    resized.save(upload_path, format=image_format, quality=quality)
+    return upload_path, (width / size[0], height / size[1])
+
+
+# Upload a file to the Gradio server once and return a file reference that
+# can be passed to every later predict() call. The reference is the path of
+# the upload on the server; without the FileData "meta" marker gradio_client
+# forwards it as-is instead of uploading the bytes again. (A URL to the
+# server's file route would make newer servers download the file from
+# themselves, which their SSRF protection refuses for local addresses.)
+def upload_to_server(client, file_path):
+    with open(file_path, "rb") as f:
+        response = httpx.post(
+            client.upload_url,
+            headers=client.headers,
+            cookies=getattr(client, "cookies", None),
+            verify=getattr(client, "ssl_verify", True),
+            files=[("files", (os.path.basename(file_path), f))],
+            **getattr(client, "httpx_kwargs", {}),
+        )
+    response.raise_for_status()
+    return {"path": response.json()[0], "orig_name": os.path.basename(file_path)}
+
+
+# Map the bboxes in a Florence result string back to original pixel
+# coordinates. Results without bboxes (captions) are returned unchanged.
+def rescale_result(result_text, scale):
+    if scale == (1.0, 1.0):
+        return result_text
+    try:
+        data = ast.literal_eval(result_text)
+    except (ValueError, SyntaxError):
+        return result_text
+    if not isinstance(data, dict):
+        return result_text
+
+    scale_x, scale_y = scale
+    changed = False
+    for value in data.values():
+        if isinstance(value, dict) and "bboxes" in value:
+            value["bboxes"] = [
+                [round(x1 * scale_x, 2), round(y1 * scale_y, 2), round(x2 * scale_x, 2), round(y2 * scale_y, 2)]
+                for x1, y1, x2, y2 in value["bboxes"]
+            ]
+            changed = True
+    return str(data) if changed else result_text
+
+
+class ImageUpload:
+    # Shared by all task jobs of one image: the first job that needs the file
+    # prepares it (and, with upload_once, uploads it), the others reuse the
+    # result. cleanup() removes the downscaled copy once the image is finished.
+    def __init__(
+        self, image_path, max_side=0, image_format="JPEG", quality=90, tmp_dir=None, upload_once=True
+    ):
+        self.image_path = image_path
+        self.max_side = max_side
+        self.image_format = image_format
+        self.quality = quality
+        self.tmp_dir = tmp_dir
+        self.upload_once = upload_once
+        self.bytes_uploaded = 0
+        self._lock = threading.Lock()
+        self._prepared = None
+        self._remote = {}  # Server-side copies, keyed by endpoint
+
+    def _prepare(self):
+        if self._prepared is None:
+            self._prepared = prepare_upload(
+                self.image_path, self.max_side, self.image_format, self.quality, self.tmp_dir
+            )
+        return self._prepared
+
+    # File argument for client.predict plus the scale of the sent image
+    def file_for(self, client):
+        with self._lock:
+            upload_path, scale = self._prepare()
+            if not self.upload_once:
+                self.bytes_uploaded += os.path.getsize(upload_path)
+                return handle_file(upload_path), scale
+            if client.src not in self._remote:
+                self._remote[client.src] = upload_to_server(client, upload_path)
+                self.bytes_uploaded += os.path.getsize(upload_path)
+            return self._remote[client.src], scale
+
+    def cleanup(self):
+        with self._lock:
+            if self._prepared is not None and self._prepared[0] != self.image_path:
+                try:
+                    os.unlink(self._prepared[0])
+                except FileNotFoundError:
+                    pass
+            self._prepared = None